@@ -1,12 +1,21 @@
 """
 Configuration management for Invoice OCR System
 """
-from pydantic_settings import BaseSettings
-from typing import Literal
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import List, Literal
 
 
 class Settings(BaseSettings):
-    """Application settings loaded from environment variables"""
+    """Application settings loaded from INVOICE_OCR_* environment variables"""
+
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        env_prefix="INVOICE_OCR_",
+        case_sensitive=False,
+        extra="ignore",
+    )
     
     # LLM Provider Configuration
     llm_provider: Literal["gemini", "openai", "ollama"] = "ollama"
@@ -19,31 +28,72 @@ class Settings(BaseSettings):
     
     # Model Configuration
     gemini_model: str = "gemini-2.0-flash"
+    gemini_upload_files: bool = False  # Upload pages via the Files API instead of inline base64
     openai_model: str = "gpt-4o-mini"
     
     # Processing Limits
     max_pages_per_invoice: int = 50
     max_file_size_mb: int = 10
-    pages_per_chunk: int = 2  # Safe for 512MB RAM - prevents OOM crashes
+    pages_per_chunk: int = 2  # Safe for 512MB RAM - prevents OOM crashes; 0 = one request per document
 
     # Image Processing (Minimal memory usage for 512MB RAM)
-    pdf_dpi: int = 220
+    pdf_dpi: int = 200
+    pdf_small_text_dpi: int = 300  # Re-render pages with tiny text at this DPI; 0 disables
     image_quality: int = 90
     enable_image_enhancement: bool = False  # Disable to save RAM during processing
+    skip_redundant_pages: bool = False  # Don't send blank or exact duplicate PDF pages to the LLM
+
+    # Result cache (documents kept in memory; 0 disables caching)
+    enable_result_cache: bool = True
+    result_cache_size: int = 512
+    chunk_cache_size: int = 1024  # LLM responses kept per page chunk
 
     # LLM Settings
     llm_temperature: float = 0.1
     llm_timeout: int = 180  # Longer timeout for large invoices
     max_output_tokens: int = 16384  # Increased for complex invoices
+    llm_concurrency: int = 4  # Max chunk requests in flight per document
+    llm_requests_per_minute: int = 0  # Provider request budget per worker; 0 disables
+    llm_tokens_per_minute: int = 0  # Provider input-token budget per worker (estimated); 0 disables
+    max_concurrent_ocr: int = 2  # Documents converted/extracted at once per worker; bounds RAM and CPU
     
+    # CORS (comma-separated origins; "*" allows any origin)
+    cors_allowed_origins: str = "*"
+    cors_allow_credentials: bool = False
+
+    # Server (used by `python main.py`)
+    uvicorn_workers: int = 1  # Each worker holds its own copy of the app in RAM
+
     # Logging
     log_level: str = "INFO"
-    
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-        case_sensitive = False
 
+    @property
+    def cors_origins(self) -> List[str]:
+        """Allowed CORS origins parsed from the comma-separated setting"""
+        return [origin.strip() for origin in self.cors_allowed_origins.split(",") if origin.strip()]
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Get the process-wide settings instance
+
+    Settings are read from the environment and `.env` exactly once; every
+    module shares the same instance instead of constructing its own.
+
+    Returns:
+        Cached Settings instance
+    """
+    return Settings()
+
+
+def __getattr__(name: str):
+    """
+    Resolve the legacy `settings` module attribute on first access (PEP 562)
 
-# Global settings instance
-settings = Settings()
+    Importing this module no longer reads `.env` or scans the environment;
+    that happens the first time `settings` (or `get_settings()`) is used.
+    """
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,62 +1,143 @@
 """
 FastAPI Application for Invoice OCR
 """
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import Depends, FastAPI, HTTPException, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
 import logging
 import os
-import tempfile
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
 
-from models.models import DocumentRequest, OCRResponse, ErrorResponse
+from pydantic import BaseModel
+
+from starlette.types import ASGIApp
+
+from config.config import Settings, get_settings
+from models.models import DocumentRequest, OCRResponse, ErrorResponse, QualityProfile
 from services.invoices_ocr_service import InvoicesOCRService
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+
+def _configure_logging(settings: Settings) -> None:
+    """Configure logging from the settings"""
+    logging.basicConfig(
+        level=settings.log_level.upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create one OCR service (and its download connection pool) per worker"""
+    # Settings are first read here, at worker startup, not on `import main`
+    _configure_logging(get_settings())
+    app.state.ocr_service = InvoicesOCRService()
+    try:
+        yield
+    finally:
+        await app.state.ocr_service.aclose()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Invoice OCR API",
     description="Extract structured data from invoice documents using LLM-powered OCR",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+
+def _cors_middleware(app: ASGIApp) -> CORSMiddleware:
+    """
+    Build the CORS middleware from the settings
+
+    Starlette builds the middleware stack on the first ASGI event, so the
+    settings are read at worker startup rather than at import.
+
+    A concrete allowlist (CORS_ALLOWED_ORIGINS) or "*" without credentials lets
+    Starlette answer with static headers instead of echoing the origin per request.
+    """
+    settings = get_settings()
+    return CORSMiddleware(
+        app,
+        allow_origins=settings.cors_origins,
+        allow_credentials=settings.cors_allow_credentials,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+
 # Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Configure as needed
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(_cors_middleware)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Initialize OCR service
-ocr_service = InvoicesOCRService()
+# Uploads are read in chunks of this size so oversized files are rejected early
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# File types accepted by the upload endpoint
+ALLOWED_EXTENSIONS: frozenset[str] = frozenset({'.pdf', '.jpg', '.jpeg', '.png', '.heic'})
+_ALLOWED_EXTENSIONS_TEXT = ', '.join(sorted(ALLOWED_EXTENSIONS))
+
+# Static health check body, serialized once
+_HEALTH_BODY = b'{"status":"healthy"}'
+
+
+def get_ocr_service(request: Request) -> InvoicesOCRService:
+    """
+    Get the OCR service created at application startup
+
+    One instance per worker process; override with `app.dependency_overrides` in tests.
+    """
+    return request.app.state.ocr_service
+
+
+def _json_response(model: BaseModel, status_code: int = 200) -> Response:
+    """Serialize a response model in a single pydantic-core pass"""
+    return Response(
+        content=model.model_dump_json(),
+        status_code=status_code,
+        media_type="application/json"
+    )
+
+
+def _error(status_code: int, message: str) -> Response:
+    """Build an ErrorResponse JSON response"""
+    return _json_response(
+        ErrorResponse(is_success=False, message=message),
+        status_code
+    )
+
+
+@lru_cache(maxsize=1)
+def _index_html() -> bytes:
+    """Read the frontend entry page once per worker process"""
+    return Path("static/index.html").read_bytes()
 
 
 @app.get("/")
 async def root():
     """Serve the frontend HTML"""
-    return FileResponse("static/index.html")
+    return Response(content=_index_html(), media_type="text/html")
 
 
 @app.get("/api/v1/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy"}
+    # A new Response per request: middleware may add headers to the instance
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 
 @app.post("/api/v1/invoices/process", response_model=OCRResponse)
-async def process_invoice(request: DocumentRequest):
+async def process_invoice(
+    request: DocumentRequest,
+    ocr_service: InvoicesOCRService = Depends(get_ocr_service)
+):
     """
     Process invoice from document URL
     
@@ -67,39 +148,35 @@ async def process_invoice(request: DocumentRequest):
         OCRResponse with extracted invoice data
     """
     try:
-        logger.info(f"Processing invoice from URL: {request.document}")
+        logger.info("Processing invoice from URL: %s", request.document)
         
         # Process document
-        invoice_data, token_usage = await ocr_service.process_document(request.document)
+        invoice_data, token_usage = await ocr_service.process_document(request.document, request.quality)
         
         logger.info(
-            f"Successfully processed invoice: "
-            f"{invoice_data.total_item_count} items"
+            "Successfully processed invoice: %d items",
+            invoice_data.total_item_count
         )
         
-        return OCRResponse(
+        # Service output is already validated; skip a second validation pass
+        return _json_response(OCRResponse.model_construct(
             is_success=True,
             token_usage=token_usage,
             data=invoice_data
-        )
+        ))
         
     except Exception as e:
-        logger.error(f"Error processing invoice: {str(e)}", exc_info=True)
+        logger.error("Error processing invoice: %s", e, exc_info=True)
         
         # Return error response
-        error_response = ErrorResponse(
-            is_success=False,
-            message=str(e)
-        )
-        
-        return JSONResponse(
-            status_code=500,
-            content=error_response.model_dump()
-        )
+        return _error(500, str(e))
 
 
 @app.post("/extract-bill-data", response_model=OCRResponse)
-async def extract_bill_data(request: DocumentRequest):
+async def extract_bill_data(
+    request: DocumentRequest,
+    ocr_service: InvoicesOCRService = Depends(get_ocr_service)
+):
     """
     Extract bill data from document URL (Submission Format Endpoint)
     
@@ -110,139 +187,127 @@ async def extract_bill_data(request: DocumentRequest):
         OCRResponse with extracted invoice data and token usage
     """
     try:
-        logger.info(f"Extracting bill data from URL: {request.document}")
+        logger.info("Extracting bill data from URL: %s", request.document)
         
         # Process document
-        invoice_data, token_usage = await ocr_service.process_document(request.document)
+        invoice_data, token_usage = await ocr_service.process_document(request.document, request.quality)
         
         logger.info(
-            f"Successfully extracted bill data: "
-            f"{invoice_data.total_item_count} items, "
-            f"tokens used: {token_usage.total_tokens}"
+            "Successfully extracted bill data: %d items, tokens used: %d",
+            invoice_data.total_item_count,
+            token_usage.total_tokens
         )
         
-        return OCRResponse(
+        # Service output is already validated; skip a second validation pass
+        return _json_response(OCRResponse.model_construct(
             is_success=True,
             token_usage=token_usage,
             data=invoice_data
-        )
+        ))
         
     except Exception as e:
-        logger.error(f"Error extracting bill data: {str(e)}", exc_info=True)
+        logger.error("Error extracting bill data: %s", e, exc_info=True)
         
         # Return error response
-        error_response = ErrorResponse(
-            is_success=False,
-            message=f"Failed to process document. {str(e)}"
-        )
-        
-        return JSONResponse(
-            status_code=500,
-            content=error_response.model_dump()
-        )
+        return _error(500, f"Failed to process document. {str(e)}")
 
 
 @app.post("/api/v1/invoices/upload", response_model=OCRResponse)
-async def upload_invoice(file: UploadFile = File(...)):
+async def upload_invoice(
+    file: UploadFile = File(...),
+    quality: QualityProfile = Form("balanced"),
+    ocr_service: InvoicesOCRService = Depends(get_ocr_service),
+    settings: Settings = Depends(get_settings)
+):
     """
     Upload and process invoice file
     
     Args:
         file: Uploaded file (PDF or image)
+        quality: Image quality profile (fast, balanced or max)
         
     Returns:
         OCRResponse with extracted invoice data
     """
     try:
-        logger.info(f"Processing uploaded file: {file.filename}")
+        logger.info("Processing uploaded file: %s", file.filename)
         
         # Validate file type
-        allowed_extensions = {'.pdf', '.jpg', '.jpeg', '.png', '.heic'}
-        file_ext = Path(file.filename).suffix.lower()
+        file_ext = os.path.splitext(file.filename or "")[1].lower()
         
-        if file_ext not in allowed_extensions:
+        if file_ext not in ALLOWED_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
-                detail=f"Unsupported file type: {file_ext}. Allowed: {', '.join(allowed_extensions)}"
+                detail=f"Unsupported file type: {file_ext}. Allowed: {_ALLOWED_EXTENSIONS_TEXT}"
             )
         
-        # Save uploaded file temporarily
-        temp_dir = tempfile.mkdtemp()
-        temp_path = os.path.join(temp_dir, file.filename)
-        
-        try:
-            # Write file
-            with open(temp_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
-            
-            # Process the file directly
-            invoice_data, token_usage = await ocr_service.process_file(temp_path)
-            
-            logger.info(
-                f"Successfully processed file: "
-                f"{invoice_data.total_item_count} items"
-            )
-            
-            return OCRResponse(
-                is_success=True,
-                token_usage=token_usage,
-                data=invoice_data
-            )
-            
-        finally:
-            # Cleanup
-            try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                os.rmdir(temp_dir)
-            except Exception:
-                pass
+        # Read the upload in chunks, rejecting it as soon as it exceeds the limit
+        max_bytes = settings.max_file_size_mb * 1024 * 1024
+        chunks = []
+        size = 0
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Maximum size is {settings.max_file_size_mb} MB"
+                )
+
+        # Process the upload from memory (no temp file round-trip). Joined into
+        # immutable bytes: an image passed through unchanged becomes the page
+        # sent to the provider, and httpx cannot send a bytearray as content
+        content = b"".join(chunks)
+        invoice_data, token_usage = await ocr_service.process_bytes(content, file.filename, quality)
+
+        logger.info(
+            "Successfully processed file: %d items",
+            invoice_data.total_item_count
+        )
+
+        # Service output is already validated; skip a second validation pass
+        return _json_response(OCRResponse.model_construct(
+            is_success=True,
+            token_usage=token_usage,
+            data=invoice_data
+        ))
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error processing uploaded file: {str(e)}", exc_info=True)
-        
-        error_response = ErrorResponse(
-            is_success=False,
-            message=str(e)
-        )
+        logger.error("Error processing uploaded file: %s", e, exc_info=True)
         
-        return JSONResponse(
-            status_code=500,
-            content=error_response.model_dump()
-        )
+        return _error(500, str(e))
 
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     """Handle HTTP exceptions"""
-    error_response = ErrorResponse(
-        is_success=False,
-        message=exc.detail
-    )
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=error_response.model_dump()
-    )
+    return _error(exc.status_code, exc.detail)
 
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     """Handle general exceptions"""
-    logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
+    logger.error("Unhandled exception: %s", exc, exc_info=True)
     
-    error_response = ErrorResponse(
-        is_success=False,
-        message="Internal server error"
-    )
-    return JSONResponse(
-        status_code=500,
-        content=error_response.model_dump()
-    )
+    return _error(500, "Internal server error")
 
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    # uvloop/httptools ship with uvicorn[standard]; uvloop is unavailable on Windows
+    has_uvloop = importlib.util.find_spec("uvloop") is not None
+    has_httptools = importlib.util.find_spec("httptools") is not None
+
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop" if has_uvloop else "asyncio",
+        http="httptools" if has_httptools else "h11",
+        workers=get_settings().uvicorn_workers,
+        log_level=get_settings().log_level.lower()
+    )
@@ -1,17 +1,36 @@
 """
 Pydantic models for Invoice OCR API
 """
-from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Final, List, Literal, Optional, Tuple, get_args
+
+
+# Page classification; the JSON schema enum and the post-processing
+# validators share the same constants
+PageType = Literal["Bill Detail", "Final Bill", "Pharmacy"]
+PAGE_TYPES: Final[Tuple[str, ...]] = get_args(PageType)
+DEFAULT_PAGE_TYPE: Final[str] = "Bill Detail"
+
+
+# Rendering profile: trades page image size (DPI / JPEG quality) for accuracy
+QualityProfile = Literal["fast", "balanced", "max"]
 
 
 class DocumentRequest(BaseModel):
     """Request model for invoice processing"""
+    model_config = ConfigDict(extra='ignore')
+
     document: str = Field(..., description="URL to the document (image or PDF)")
+    quality: QualityProfile = Field(
+        default="balanced",
+        description="Image quality profile: fast (180 DPI), balanced (configured defaults) or max (300 DPI)"
+    )
 
 
 class BillItem(BaseModel):
     """Individual line item in the bill"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     item_name: str = Field(..., description="Item description/name exactly as mentioned in the bill")
     item_amount: float = Field(..., description="Net amount of the item post discounts as mentioned in the bill")
     item_rate: float = Field(..., description="Unit price/rate exactly as mentioned in the bill")
@@ -20,32 +39,57 @@ class BillItem(BaseModel):
 
 class PagewiseLineItems(BaseModel):
     """Line items grouped by page"""
+    model_config = ConfigDict(
+        frozen=True,
+        extra='ignore',
+        json_schema_serialization_defaults_required=True
+    )
+
     page_no: str = Field(..., description="Page number as string")
-    page_type: Literal["Bill Detail", "Final Bill", "Pharmacy"] = Field(
+    page_type: PageType = Field(
         ...,
-        description="Type of page: Bill Detail, Final Bill, or Pharmacy"
+        description=(
+            "Type of page - REQUIRED, NEVER NULL. Must be one of: "
+            "'Bill Detail' (pages with section headers and SubTotals), "
+            "'Final Bill' (summary page with Grand Total and department totals), or "
+            "'Pharmacy' (flat list of medicines without sections)"
+        )
     )
     bill_items: List[BillItem] = Field(default_factory=list, description="All items on this page")
 
 
 class TokenUsage(BaseModel):
     """Token usage information from LLM calls"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     total_tokens: int = Field(..., description="Cumulative tokens from all LLM calls")
     input_tokens: int = Field(..., description="Cumulative input tokens from all LLM calls")
     output_tokens: int = Field(..., description="Cumulative output tokens from all LLM calls")
 
 
-class InvoiceData(BaseModel):
-    """Complete invoice data"""
+class ExtractedInvoiceData(BaseModel):
+    """Invoice line items as extracted by the LLM, before totals are calculated"""
+    model_config = ConfigDict(
+        frozen=True,
+        extra='ignore',
+        json_schema_serialization_defaults_required=True
+    )
+
     pagewise_line_items: List[PagewiseLineItems] = Field(
         default_factory=list,
         description="Items grouped by page number"
     )
+
+
+class InvoiceData(ExtractedInvoiceData):
+    """Complete invoice data"""
     total_item_count: int = Field(..., description="Count of items across all pages")
 
 
 class OCRResponse(BaseModel):
     """Successful API response"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     is_success: bool = Field(default=True, description="Success status - true if status code 200 and valid schema")
     token_usage: TokenUsage = Field(..., description="Token usage from LLM calls")
     data: InvoiceData = Field(..., description="Extracted invoice data")
@@ -53,5 +97,7 @@ class OCRResponse(BaseModel):
 
 class ErrorResponse(BaseModel):
     """Error API response"""
+    model_config = ConfigDict(extra='ignore')
+
     is_success: bool = Field(default=False, description="Success status (always false for errors)")
     message: str = Field(..., description="Error message describing what went wrong")
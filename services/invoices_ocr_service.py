@@ -1,21 +1,42 @@
 """
 Main Invoice OCR Service
 """
+import asyncio
+import hashlib
+import io
 import os
+import shutil
+import statistics
+import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import groupby
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple, Union, get_args
 from urllib.parse import urlparse
 import httpx
-from pdf2image import convert_from_path
-from PIL import Image, ImageEnhance, ImageFilter
+from pydantic import TypeAdapter
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image, ImageFilter, ImageStat
 import pillow_heif
 
-from config.config import settings
-from services.llm_wrapper import LLMWrapper
-from services.invoices_ocr_prompts import generate_extraction_prompt, get_json_schema
-from models.models import InvoiceData, PagewiseLineItems, BillItem, TokenUsage
+from config.config import get_settings
+from services.llm_wrapper import HTTP2_AVAILABLE, LLMWrapper, PageImage
+from services.invoices_ocr_prompts import (
+    PromptSpec,
+    PromptVariant,
+    get_json_schema,
+    get_prompt_spec
+)
+from models.models import (
+    InvoiceData,
+    PagewiseLineItems,
+    QualityProfile,
+    TokenUsage
+)
 from utils.data_validator import validate_and_clean_invoice_data, remove_duplicate_items
+from utils.result_cache import ResultCache, document_cache_key
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,74 +44,405 @@ logger = logging.getLogger(__name__)
 # Register HEIF opener for HEIC support
 pillow_heif.register_heif_opener()
 
+# (PDF DPI, JPEG quality) per quality profile; "balanced" uses the configured
+# pdf_dpi / image_quality settings
+QUALITY_PROFILES: Dict[str, Tuple[int, int]] = {
+    "fast": (180, 80),
+    "max": (300, 95),
+}
+
+# Prompt variant per quality profile: "fast" requests assume a clean document
+# and skip the poor-scan guidance; everything else gets the full prompt
+PROMPT_VARIANTS: Dict[str, PromptVariant] = {
+    "fast": "clean",
+}
+
+# Parallelism for PDF rendering (poppler processes) and page post-processing
+# threads; Pillow releases the GIL while enhancing and encoding
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+
+# Enhancement strengths for faint / blurry scans
+CONTRAST_FACTOR = 1.3
+SHARPNESS_FACTOR = 1.5
+
+# ImageEnhance.Sharpness(f) blends the image with ImageFilter.SMOOTH
+# ([1 1 1; 1 5 1; 1 1 1] / 13) as f * image - (f - 1) * smooth; the blend
+# folded into one 3x3 kernel sharpens in a single pass
+SHARPEN_KERNEL = ImageFilter.Kernel(
+    (3, 3),
+    (-(SHARPNESS_FACTOR - 1),) * 4 + (8 * SHARPNESS_FACTOR + 5,) + (-(SHARPNESS_FACTOR - 1),) * 4,
+    scale=13
+)
+
+
+# Baseline 4:2:0 JPEGs: Pillow's libjpeg-turbo encoder takes its fastest
+# path, and chroma at half resolution does not affect reading dark text.
+# Pinned so a source image's own JPEG settings or a Pillow default change
+# cannot make page encoding slower or larger
+JPEG_SAVE_OPTIONS: Dict[str, Any] = {"subsampling": 2, "progressive": False, "optimize": False}
+
+# Uploaded images every provider accepts as they are: these are sent with
+# their original bytes instead of being decoded and re-encoded (unless
+# enhancement is on, or an EXIF rotation would be lost)
+PASSTHROUGH_FORMATS = frozenset({"JPEG", "PNG"})
+PASSTHROUGH_MODES = frozenset({"RGB", "L"})
+EXIF_ORIENTATION = 0x0112
+
+# Pages whose text lines are shorter than this (in rendered pixels) are
+# re-rendered at the small-text DPI
+SMALL_TEXT_HEIGHT = 12
+
+# Text line detection: the page is split into vertical strips, and a run of
+# at least TEXT_MIN_RUN rows darker than the strip background by
+# TEXT_INK_CONTRAST grey levels counts as one text line
+TEXT_PROFILE_STRIPS = 4
+TEXT_INK_CONTRAST = 6
+TEXT_MIN_RUN = 3
+
+
+def _text_line_height(image: Image.Image) -> Optional[float]:
+    """
+    Estimate the median text line height of a page image
+
+    Each vertical strip is box-averaged down to a single column in C, so
+    only a few thousand row values are scanned in Python.
+
+    Args:
+        image: Page image
+
+    Returns:
+        Median line height in pixels, or None when no text lines are found
+    """
+    profile = image.convert("L").resize((TEXT_PROFILE_STRIPS, image.height), Image.Resampling.BOX)
+    rows = profile.tobytes()
+    runs: List[int] = []
+    for strip in range(TEXT_PROFILE_STRIPS):
+        column = rows[strip::TEXT_PROFILE_STRIPS]
+        background = sorted(column)[len(column) * 9 // 10]
+        run = 0
+        for value in column + b"\xff":
+            if value < background - TEXT_INK_CONTRAST:
+                run += 1
+                continue
+            if run >= TEXT_MIN_RUN:
+                runs.append(run)
+            run = 0
+    return statistics.median(runs) if runs else None
+
+
+# Blank page detection: the page is box-averaged down by BLANK_NOISE_REDUCE
+# (which evens out scanner noise) and counts as blank only if almost no
+# pixels differ from its background by more than BLANK_INK_CONTRAST grey
+# levels (either way, so light text on a dark page counts too).
+# The cutoff is a handful of pixels on an A4 page, below even a lone faint
+# page number, so doubtful pages are kept
+BLANK_NOISE_REDUCE = 4
+BLANK_INK_CONTRAST = 8
+BLANK_MAX_INK_FRACTION = 0.00002
+
+
+def _is_blank_page(image: Image.Image) -> bool:
+    """
+    Check whether a page image is a single flat tone (no ink at all)
+
+    Works on the greyscale histogram of the whole page (computed in C), so
+    faint or low-contrast scans still count as inked.
+
+    Args:
+        image: Page image
+
+    Returns:
+        True if the page is blank
+    """
+    histogram = image.convert("L").reduce(BLANK_NOISE_REDUCE).histogram()
+    total = sum(histogram)
+
+    # Background is the median grey level
+    seen = 0
+    for background, count in enumerate(histogram):
+        seen += count
+        if seen * 2 >= total:
+            break
+
+    ink = (
+        sum(histogram[:max(background - BLANK_INK_CONTRAST, 0)])
+        + sum(histogram[background + BLANK_INK_CONTRAST + 1:])
+    )
+    return ink <= total * BLANK_MAX_INK_FRACTION
+
+
+# A page with a raster image at least this large (pixels, either side) is
+# treated as a scan; other pages are vector output from a digital PDF
+SCAN_MIN_IMAGE_SIZE = 1000
+
+# Timeout in seconds for listing a PDF's images
+PDFIMAGES_TIMEOUT = 30
+
+
+def _scanned_pages(pdf_path: str) -> Optional[Set[int]]:
+    """
+    Find the PDF pages that hold a scanned (large raster) image
+
+    Pages without one render crisp already, so enhancing them is wasted
+    work. Uses poppler's pdfimages, installed alongside pdftoppm.
+
+    Args:
+        pdf_path: Path to the PDF
+
+    Returns:
+        Page numbers (1-based), or None when the PDF's images can't be listed
+    """
+    try:
+        listing = subprocess.run(
+            ["pdfimages", "-list", pdf_path],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=PDFIMAGES_TIMEOUT
+        ).stdout
+
+        # Columns: page num type width height ...; two header lines
+        pages = set()
+        for line in listing.splitlines()[2:]:
+            fields = line.split()
+            if (
+                len(fields) > 4 and fields[2] == "image"
+                and max(int(fields[3]), int(fields[4])) >= SCAN_MIN_IMAGE_SIZE
+            ):
+                pages.add(int(fields[0]))
+        return pages
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        logger.warning(f"Could not list PDF images, treating every page as a scan: {e}")
+        return None
+
+
+def _file_sha256(path: str) -> bytes:
+    """SHA-256 digest of a file's contents"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").digest()
+
+
+@lru_cache(maxsize=256)
+def _contrast_lut(mean: int) -> List[int]:
+    """Per-channel lookup table equivalent to ImageEnhance.Contrast around a mean grey level"""
+    return [
+        max(0, min(255, int(mean + CONTRAST_FACTOR * (value - mean))))
+        for value in range(256)
+    ]
+
+
+# Validates every extracted page (and its items) in one call
+_PAGEWISE_ITEMS_ADAPTER = TypeAdapter(List[PagewiseLineItems])
+
+# Timeout in seconds for downloading a document
+DOWNLOAD_TIMEOUT = 30.0
+
+# Downloads are streamed to disk in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+# Connection pool for document downloads (HTTP/2 when "h2" is installed)
+DOWNLOAD_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
 
 class InvoicesOCRService:
     """Service for processing invoices and extracting structured data"""
     
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        """
+        Initialize the service
+
+        Args:
+            http_client: Shared client for document downloads; the service
+                creates (and closes in `aclose`) its own pooled client when omitted
+        """
+        self.settings = get_settings()
+        self._owns_http_client = http_client is None
+        self.http_client = http_client or httpx.AsyncClient(
+            timeout=DOWNLOAD_TIMEOUT,
+            http2=HTTP2_AVAILABLE,
+            limits=DOWNLOAD_LIMITS
+        )
         self.llm_wrapper = LLMWrapper()
-        self.max_pages = settings.max_pages_per_invoice
+        self.max_pages = self.settings.max_pages_per_invoice
         self.temp_dir = tempfile.mkdtemp()
+        # Bounds the CPU / memory of documents in flight on this worker
+        self.ocr_semaphore = asyncio.Semaphore(max(1, self.settings.max_concurrent_ocr))
+        self.result_cache: ResultCache[Tuple[InvoiceData, TokenUsage]] = ResultCache(
+            self.settings.result_cache_size if self.settings.enable_result_cache else 0
+        )
+
+        # Build every prompt variant up front and keep the references: surfaces
+        # a prompt over its token budget at startup instead of on a request
+        self.prompt_specs: Dict[str, PromptSpec] = {
+            variant: get_prompt_spec(variant) for variant in get_args(PromptVariant)
+        }
+        self.json_schema = get_json_schema()
+
+    async def aclose(self) -> None:
+        """Close the HTTP clients (if owned) and remove the service temp directory"""
+        if self._owns_http_client:
+            await self.http_client.aclose()
+        await self.llm_wrapper.aclose()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
     
-    async def process_document(self, document_url: str) -> tuple[InvoiceData, TokenUsage]:
+    async def process_document(
+        self,
+        document_url: str,
+        quality: QualityProfile = "balanced"
+    ) -> tuple[InvoiceData, TokenUsage]:
         """
         Process invoice from document URL
         
         Args:
             document_url: URL to the document (image or PDF)
+            quality: Image quality profile used when rendering pages
             
         Returns:
             Tuple of (InvoiceData with extracted information, TokenUsage)
         """
-        # Download document
-        document_path = await self._download_document(document_url)
-        
-        try:
-            # Convert to images
-            image_paths = self._convert_to_images(document_path)
-            
-            # Extract data with LLM
-            extracted_data, token_usage = self._extract_data_with_llm(image_paths)
-            
-            # Calculate totals
-            invoice_data = self._calculate_totals(extracted_data)
-            
-            return invoice_data, TokenUsage(**token_usage)
-            
-        finally:
-            # Cleanup
-            self._cleanup(document_path, image_paths if 'image_paths' in locals() else [])
+        # The downloaded document is removed with its directory
+        with self._request_dir() as download_dir:
+            document_path, digest = await self._download_document(document_url, download_dir)
+            return await self._process_cached(digest, quality, document_path, document_path)
     
-    async def process_file(self, file_path: str) -> tuple[InvoiceData, TokenUsage]:
+    async def process_file(
+        self,
+        file_path: str,
+        quality: QualityProfile = "balanced"
+    ) -> tuple[InvoiceData, TokenUsage]:
         """
         Process invoice from local file path
         
         Args:
             file_path: Path to the local file
+            quality: Image quality profile used when rendering pages
             
         Returns:
             Tuple of (InvoiceData with extracted information, TokenUsage)
         """
-        try:
-            # Convert to images
-            image_paths = self._convert_to_images(file_path)
-            
-            # Extract data with LLM
-            extracted_data, token_usage = self._extract_data_with_llm(image_paths)
-            
-            # Calculate totals
-            invoice_data = self._calculate_totals(extracted_data)
-            
-            return invoice_data, TokenUsage(**token_usage)
-            
-        finally:
-            # Cleanup image files (but not the original file)
-            self._cleanup("", image_paths if 'image_paths' in locals() else [])
+        digest = await asyncio.to_thread(_file_sha256, file_path)
+
+        # The original file is left in place
+        return await self._process_cached(digest, quality, file_path, file_path)
+
+    async def process_bytes(
+        self,
+        data: bytes,
+        filename: str,
+        quality: QualityProfile = "balanced"
+    ) -> tuple[InvoiceData, TokenUsage]:
+        """
+        Process invoice from in-memory file contents
+
+        Args:
+            data: Raw bytes of the uploaded file (PDF or image)
+            filename: Original file name, used to detect the file type
+            quality: Image quality profile used when rendering pages
+
+        Returns:
+            Tuple of (InvoiceData with extracted information, TokenUsage)
+        """
+        # hashlib releases the GIL for large buffers
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).digest())
+        return await self._process_cached(digest, quality, data, filename)
+
+    async def _process_cached(
+        self,
+        digest: bytes,
+        quality: QualityProfile,
+        source: Union[str, bytes],
+        filename: str
+    ) -> tuple[InvoiceData, TokenUsage]:
+        """
+        Convert and extract a document unless an identical one was processed
+
+        Identical documents yield the same result, so the cache is keyed on
+        a digest of the document bytes (not the URL or file name); a hit
+        skips page rendering as well as the LLM call. At most
+        max_concurrent_ocr documents are converted and extracted at once.
+
+        Args:
+            digest: SHA-256 digest of the raw document bytes
+            quality: Image quality profile used when rendering pages
+            source: Path to the document, or its bytes
+            filename: File name used to detect the file type
+
+        Returns:
+            Tuple of (InvoiceData with extracted information, TokenUsage)
+        """
+        cache_key = self._result_cache_key(digest, quality)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Result cache hit, skipping extraction")
+            return cached
+
+        async with self.ocr_semaphore:
+            # An identical document may have finished while this one waited
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Result cache hit, skipping extraction")
+                return cached
+
+            if Path(filename).suffix.lower() == ".pdf":
+                extracted_data, token_usage = await self._extract_pdf_with_llm(source, quality)
+            else:
+                # Convert to an in-memory JPEG (if needed) off the event loop
+                images = await asyncio.to_thread(self._convert_image, source, quality)
+
+                # Extract data with LLM
+                extracted_data, token_usage = await self._extract_data_with_llm(images, quality)
+
+            # Calculate totals (validation is per-item Python work)
+            invoice_data = await asyncio.to_thread(self._calculate_totals, extracted_data)
+
+        result = invoice_data, TokenUsage(**token_usage)
+        self.result_cache.put(cache_key, result)
+        return result
     
-    async def _download_document(self, url: str) -> str:
-        """Download document from URL"""
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
+    def _prompt_spec(self, quality: QualityProfile) -> PromptSpec:
+        """Pick the prompt for a quality profile"""
+        return self.prompt_specs[PROMPT_VARIANTS.get(quality, "poor")]
+
+    def _result_cache_key(self, digest: bytes, quality: QualityProfile) -> str:
+        """
+        Build the result cache key for a document
+
+        Args:
+            digest: SHA-256 digest of the raw document bytes
+            quality: Image quality profile
+
+        Returns:
+            Key covering everything that changes the extraction result
+        """
+        spec = self._prompt_spec(quality)
+        return document_cache_key(
+            digest,
+            spec.version,
+            spec.fingerprint,
+            self.llm_wrapper.provider,
+            self.llm_wrapper.model_name,
+            quality
+        )
+
+    def _request_dir(self) -> tempfile.TemporaryDirectory:
+        """Per-request scratch directory, removed in one rmtree when the request ends"""
+        return tempfile.TemporaryDirectory(dir=self.temp_dir, ignore_cleanup_errors=True)
+
+    async def _download_document(self, url: str, directory: str) -> Tuple[str, bytes]:
+        """
+        Stream a document from a URL to a temp file
+
+        The body is written and hashed chunk by chunk, so memory use does not
+        grow with the document size.
+
+        Args:
+            url: Document URL
+            directory: Directory to save the document in
+
+        Returns:
+            Tuple of (temp file path, SHA-256 digest of the contents)
+        """
+        async with self.http_client.stream("GET", url) as response:
             response.raise_for_status()
 
             # Parse URL to get clean path without query parameters
@@ -108,60 +460,306 @@ class InvoicesOCRService:
                 ext = Path(clean_path).suffix or ".pdf"
 
             # Save to temp file with clean extension
-            temp_path = os.path.join(self.temp_dir, f"document{ext}")
+            temp_path = os.path.join(directory, f"document{ext}")
+            digest = hashlib.sha256()
             with open(temp_path, "wb") as f:
-                f.write(response.content)
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
 
-            return temp_path
+        return temp_path, digest.digest()
     
-    def _convert_to_images(self, document_path: str) -> List[str]:
+    def _render_options(self, quality: QualityProfile) -> Tuple[int, int]:
         """
-        Convert document to images
-        
+        Resolve a quality profile to rendering options
+
         Args:
-            document_path: Path to the document file
-            
+            quality: Image quality profile
+
         Returns:
-            List of image file paths
+            Tuple of (PDF DPI, JPEG quality)
         """
-        file_ext = Path(document_path).suffix.lower()
-        
-        if file_ext == ".pdf":
-            return self._convert_pdf_to_images(document_path)
-        else:
-            return self._process_image_file(document_path)
-    
-    def _convert_pdf_to_images(self, pdf_path: str) -> List[str]:
-        """Convert PDF to images with configurable quality"""
-        logger.info(f"Converting PDF to images at {settings.pdf_dpi} DPI")
-
-        # Convert PDF to images with higher DPI
-        images = convert_from_path(
-            pdf_path,
-            dpi=settings.pdf_dpi,
-            fmt="jpeg",
-            thread_count=2
+        return QUALITY_PROFILES.get(
+            quality,
+            (self.settings.pdf_dpi, self.settings.image_quality)
         )
 
-        # Check page limit
-        if len(images) > self.max_pages:
-            raise ValueError(
-                f"PDF has {len(images)} pages, exceeds limit of {self.max_pages}"
+    def _convert_image(self, source: Union[str, bytes], quality: QualityProfile = "balanced") -> List[PageImage]:
+        """
+        Convert an image document (path or bytes) to a normalized JPEG
+
+        JPEG and PNG images that need no conversion are passed through
+        unchanged, saving a full decode and re-encode.
+
+        Args:
+            source: Path to the image file, or its bytes
+            quality: Image quality profile
+
+        Returns:
+            List with the single page image (the source itself, or JPEG bytes)
+        """
+        _, jpeg_quality = self._render_options(quality)
+        image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+        if (
+            not self.settings.enable_image_enhancement
+            and image.format in PASSTHROUGH_FORMATS
+            and image.mode in PASSTHROUGH_MODES
+            and image.getexif().get(EXIF_ORIENTATION, 1) == 1
+        ):
+            image.close()
+            return [source]
+        return self._save_image(image, jpeg_quality)
+
+    async def _extract_pdf_with_llm(
+        self,
+        source: Union[str, bytes],
+        quality: QualityProfile = "balanced"
+    ) -> tuple[Dict[str, Any], Dict[str, int]]:
+        """
+        Render a PDF chunk by chunk, sending each chunk to the LLM as soon
+        as it is rendered
+
+        Rendering the next chunk overlaps with the LLM calls for earlier
+        ones instead of waiting for the whole document to be rasterized.
+
+        Args:
+            source: Path to the PDF, or its bytes
+            quality: Image quality profile
+
+        Returns:
+            Tuple of (extracted data, token usage dict)
+        """
+        dpi, jpeg_quality = self._render_options(quality)
+        spec = self._prompt_spec(quality)
+
+        # Page images and the PDF copy are removed with the request directory
+        with self._request_dir() as request_dir:
+            if not isinstance(source, str):
+                # Written once so each chunk renders from the same file
+                pdf_path = os.path.join(request_dir, "document.pdf")
+                await asyncio.to_thread(Path(pdf_path).write_bytes, source)
+            else:
+                pdf_path = source
+
+            # Check page limit before rendering anything
+            page_count = (await asyncio.to_thread(pdfinfo_from_path, pdf_path))["Pages"]
+            if page_count > self.max_pages:
+                raise ValueError(
+                    f"PDF has {page_count} pages, exceeds limit of {self.max_pages}"
+                )
+
+            logger.info(f"Converting {page_count} PDF pages to images at {dpi} DPI")
+            chunk_size = self.settings.pages_per_chunk or self.max_pages
+
+            # Only scanned pages are enhanced (None: treat every page as a scan)
+            scanned_pages: Optional[Set[int]] = None
+            if self.settings.enable_image_enhancement:
+                scanned_pages = await asyncio.to_thread(_scanned_pages, pdf_path)
+                if scanned_pages is not None and len(scanned_pages) < page_count:
+                    logger.info(
+                        f"{page_count - len(scanned_pages)} of {page_count} pages are digital, "
+                        f"skipping enhancement for them"
+                    )
+
+            seen_pages: Set[bytes] = set()
+
+            async def render_chunks() -> AsyncIterator[List[PageImage]]:
+                for first_page in range(1, page_count + 1, chunk_size):
+                    last_page = min(first_page + chunk_size - 1, page_count)
+                    chunk = await asyncio.to_thread(
+                        self._render_pdf,
+                        pdf_path, dpi, jpeg_quality, first_page, last_page,
+                        request_dir, seen_pages, scanned_pages
+                    )
+                    # Chunks whose pages were all skipped cost no request
+                    if chunk:
+                        yield chunk
+
+            extracted_data, token_usage = await self.llm_wrapper.process_chunk_stream(
+                render_chunks(),
+                page_count,
+                spec.text,
+                self.json_schema
             )
 
-        # Save images with enhancement
-        image_paths = []
-        for i, image in enumerate(images):
-            # Enhance image if enabled
-            if settings.enable_image_enhancement:
-                image = self._enhance_image(image)
+        total_items = sum(len(page.get('bill_items', [])) for page in extracted_data.get('pagewise_line_items', []))
+        logger.info(
+            f"LLM extracted {total_items} items from {page_count} pages before validation "
+            f"(prompt v{spec.version} {spec.variant} {spec.fingerprint})"
+        )
 
-            image_path = os.path.join(self.temp_dir, f"page_{i+1}.jpg")
-            image.save(image_path, "JPEG", quality=settings.image_quality)
-            image_paths.append(image_path)
-            logger.debug(f"Saved page {i+1} with quality={settings.image_quality}")
+        return extracted_data, token_usage
+
+    def _render_pdf(
+        self,
+        pdf_path: str,
+        dpi: int,
+        jpeg_quality: int,
+        first_page: int,
+        last_page: int,
+        request_dir: str,
+        seen_pages: Set[bytes],
+        scanned_pages: Optional[Set[int]] = None
+    ) -> List[PageImage]:
+        """
+        Render a range of PDF pages to JPEGs
 
-        return image_paths
+        Poppler renders pages straight to files in parallel processes, so
+        pages are never all held in memory. Without enhancement poppler
+        writes the final JPEG files itself; with enhancement it writes
+        lossless PPMs that a thread pool enhances and encodes in memory;
+        only scanned pages are enhanced. Pages with very small text are
+        re-rendered at the small-text DPI.
+        Blank pages and exact repeats of an earlier page are dropped when
+        skip_redundant_pages is enabled.
+
+        Args:
+            pdf_path: Path to the PDF
+            dpi: Rendering resolution
+            jpeg_quality: JPEG quality of the saved pages
+            first_page: First page to render (1-based)
+            last_page: Last page to render (inclusive)
+            request_dir: Request scratch directory the pages are written under
+            seen_pages: Digests of the document's pages rendered so far
+                (updated in place)
+            scanned_pages: Pages holding a scanned image; None treats every
+                page as a scan
+
+        Returns:
+            JPEG file paths (or JPEG bytes, when enhanced) in page order
+        """
+        small_text_dpi = self.settings.pdf_small_text_dpi
+        upscale = small_text_dpi > dpi
+        skip_redundant = self.settings.skip_redundant_pages
+        enhance = self.settings.enable_image_enhancement
+        work_dir = tempfile.mkdtemp(dir=request_dir)
+
+        def is_scanned(page_no: int) -> bool:
+            return scanned_pages is None or page_no in scanned_pages
+
+        # One poppler call per run of consecutive scanned / digital pages
+        pages: List[Tuple[PageImage, Optional[float], bool]] = []
+        for scanned, run in groupby(range(first_page, last_page + 1), key=is_scanned):
+            run = list(run)
+            pages.extend(self._render_pages(
+                pdf_path, dpi, jpeg_quality, run[0], run[-1], work_dir,
+                upscale, skip_redundant, enhance and scanned
+            ))
+
+        kept: List[PageImage] = []
+        for page_no, (page, text_height, blank) in enumerate(pages, first_page):
+            if blank:
+                logger.info(f"Skipping blank page {page_no}")
+                continue
+
+            if upscale and text_height is not None and text_height < SMALL_TEXT_HEIGHT:
+                logger.info(
+                    f"Page {page_no} has small text (~{text_height:.0f}px lines), "
+                    f"re-rendering at {small_text_dpi} DPI"
+                )
+                page = self._render_pages(
+                    pdf_path, small_text_dpi, jpeg_quality, page_no, page_no, work_dir,
+                    False, False, enhance and is_scanned(page_no)
+                )[0][0]
+
+            if skip_redundant:
+                # Poppler output is deterministic, so a repeated page
+                # renders to the same bytes
+                digest = hashlib.sha256(
+                    page if isinstance(page, bytes) else Path(page).read_bytes()
+                ).digest()
+                if digest in seen_pages:
+                    logger.info(f"Skipping page {page_no}, identical to an earlier page")
+                    continue
+                seen_pages.add(digest)
+
+            kept.append(page)
+
+        return kept
+
+    def _render_pages(
+        self,
+        pdf_path: str,
+        dpi: int,
+        jpeg_quality: int,
+        first_page: int,
+        last_page: int,
+        work_dir: str,
+        measure: bool,
+        detect_blank: bool,
+        enhance: bool
+    ) -> List[Tuple[PageImage, Optional[float], bool]]:
+        """
+        Render a range of PDF pages into a work directory
+
+        Args:
+            pdf_path: Path to the PDF
+            dpi: Rendering resolution
+            jpeg_quality: JPEG quality of the saved pages
+            first_page: First page to render (1-based)
+            last_page: Last page to render (inclusive)
+            work_dir: Directory poppler writes the pages to
+            measure: Whether to estimate each page's text line height (None
+                when no text lines are found)
+            detect_blank: Whether to check each page for blankness
+            enhance: Whether to enhance the pages (encoded in memory)
+
+        Returns:
+            (JPEG path or bytes, text line height or None, blank) per page,
+            in page order
+        """
+        page_paths = convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            fmt="ppm" if enhance else "jpeg",
+            jpegopt=None if enhance else {"quality": jpeg_quality},
+            output_folder=work_dir,
+            paths_only=True,
+            thread_count=RENDER_WORKERS,
+            first_page=first_page,
+            last_page=last_page
+        )
+
+        if not (enhance or measure or detect_blank):
+            return [(path, None, False) for path in page_paths]
+
+        with ThreadPoolExecutor(max_workers=RENDER_WORKERS) as pool:
+            return list(pool.map(
+                lambda path: self._finish_page(path, jpeg_quality, enhance, measure, detect_blank),
+                page_paths
+            ))
+
+    def _finish_page(
+        self,
+        page_path: str,
+        jpeg_quality: int,
+        enhance: bool,
+        measure: bool,
+        detect_blank: bool
+    ) -> Tuple[PageImage, Optional[float], bool]:
+        """Measure (and optionally enhance and encode) one rendered page"""
+        with Image.open(page_path) as image:
+            if not enhance:
+                # Measuring only: decode the JPEG straight to greyscale
+                image.draft("L", image.size)
+
+            text_height = _text_line_height(image) if measure else None
+            blank = detect_blank and _is_blank_page(image)
+            if not enhance:
+                return page_path, text_height, blank
+
+            page = self._encode_jpeg(self._enhance_image(image), jpeg_quality)
+
+        # The PPM is only an intermediate step
+        os.remove(page_path)
+        return page, text_height, blank
+
+    def _encode_jpeg(self, image: Image.Image, jpeg_quality: int) -> bytes:
+        """Encode an image as JPEG in memory"""
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=jpeg_quality, **JPEG_SAVE_OPTIONS)
+        logger.debug(f"Encoded image with quality={jpeg_quality}")
+        return buffer.getvalue()
     
     def _enhance_image(self, image: Image.Image) -> Image.Image:
         """
@@ -178,13 +776,14 @@ class InvoicesOCRService:
             if image.mode != "RGB":
                 image = image.convert("RGB")
 
-            # Increase contrast (helps with faint text)
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.3)  # 1.3x contrast boost
+            # Increase contrast (helps with faint text): same mapping as
+            # ImageEnhance.Contrast, applied as a single lookup-table pass
+            mean = int(ImageStat.Stat(image.convert("L")).mean[0] + 0.5)
+            image = image.point(_contrast_lut(mean) * 3)
 
-            # Increase sharpness (helps with blurry scans)
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(1.5)  # 1.5x sharpness boost
+            # Increase sharpness (helps with blurry scans): ImageEnhance.Sharpness
+            # blend folded into one convolution kernel
+            image = image.filter(SHARPEN_KERNEL)
 
             # Optional: Reduce noise (helps with grainy scans)
             # image = image.filter(ImageFilter.MedianFilter(size=3))
@@ -195,41 +794,41 @@ class InvoicesOCRService:
         except Exception:
             return image
 
-    def _process_image_file(self, image_path: str) -> List[str]:
-        """Process single image file with enhancement"""
-        # Open image
-        image = Image.open(image_path)
-
+    def _save_image(self, image: Image.Image, jpeg_quality: int) -> List[bytes]:
+        """Normalize, optionally enhance and encode a single image as JPEG"""
         # Convert to RGB
         if image.mode != "RGB":
             image = image.convert("RGB")
 
         # Enhance if enabled
-        if settings.enable_image_enhancement:
+        if self.settings.enable_image_enhancement:
             image = self._enhance_image(image)
 
-        # Save as high-quality JPEG
-        output_path = os.path.join(self.temp_dir, "page_1.jpg")
-        image.save(output_path, "JPEG", quality=settings.image_quality)
-        logger.debug(f"Processed image with quality={settings.image_quality}")
-
-        return [output_path]
+        # Encode as high-quality JPEG; kept in memory, the LLM wrapper
+        # base64-encodes it straight from the bytes
+        return [self._encode_jpeg(image, jpeg_quality)]
     
-    def _extract_data_with_llm(self, image_paths: List[str]) -> Dict[str, Any]:
+    async def _extract_data_with_llm(
+        self,
+        images: List[PageImage],
+        quality: QualityProfile = "balanced"
+    ) -> Dict[str, Any]:
         """Extract data using LLM"""
-        prompt = generate_extraction_prompt()
-        schema = get_json_schema()
+        spec = self._prompt_spec(quality)
 
-        result = self.llm_wrapper.process_with_structured_output(
-            image_paths=image_paths,
-            prompt=prompt,
-            json_schema=schema
+        result = await self.llm_wrapper.process_with_structured_output(
+            images=images,
+            prompt=spec.text,
+            json_schema=self.json_schema
         )
 
         # Log what the LLM extracted
         extracted_data, token_usage = result
         total_items = sum(len(page.get('bill_items', [])) for page in extracted_data.get('pagewise_line_items', []))
-        logger.info(f"LLM extracted {total_items} items from {len(image_paths)} images before validation")
+        logger.info(
+            f"LLM extracted {total_items} items from {len(images)} images before validation "
+            f"(prompt v{spec.version} {spec.variant} {spec.fingerprint})"
+        )
 
         return result
     
@@ -252,44 +851,15 @@ class InvoicesOCRService:
         # The LLM is instructed to extract EVERY row, including duplicates
         cleaned_data = validated_data  # Skip duplicate removal
 
-        pagewise_items = []
-        total_count = 0
-
-        for page_data in cleaned_data.get("pagewise_line_items", []):
-            bill_items = []
-
-            for item_data in page_data.get("bill_items", []):
-                try:
-                    bill_item = BillItem(
-                        item_name=item_data["item_name"],
-                        item_amount=float(item_data["item_amount"]),
-                        item_rate=float(item_data["item_rate"]),
-                        item_quantity=float(item_data["item_quantity"])
-                    )
-                    bill_items.append(bill_item)
-                    total_count += 1
-                except Exception:
-                    continue
-
-            # Get page_type from extracted data, ensure it's never null
-            # Must be one of: "Bill Detail", "Final Bill", "Pharmacy"
-            page_type = page_data.get("page_type", "Bill Detail")
-
-            # If null, empty, or invalid, default to "Bill Detail"
-            if not page_type or page_type not in ["Bill Detail", "Final Bill", "Pharmacy"]:
-                page_type = "Bill Detail"
-
-            if bill_items:  # Only add pages with items
-                pagewise_items.append(PagewiseLineItems(
-                    page_no=str(page_data["page_no"]),
-                    page_type=page_type,
-                    bill_items=bill_items
-                ))
-
-        # Renumber pages sequentially (1, 2, 3...) instead of using extracted page numbers
-        # This handles jumbled/out-of-order invoices
-        for idx, page in enumerate(pagewise_items):
-            page.page_no = str(idx + 1)
+        # The validator leaves only well-formed pages with items, so every page
+        # is built in a single pydantic-core pass. Pages are numbered
+        # sequentially (1, 2, 3...) instead of using extracted page numbers;
+        # this handles jumbled/out-of-order invoices
+        pages = cleaned_data["pagewise_line_items"]
+        for page_no, page_data in enumerate(pages, 1):
+            page_data["page_no"] = str(page_no)
+        pagewise_items = _PAGEWISE_ITEMS_ADAPTER.validate_python(pages)
+        total_count = sum(len(page.bill_items) for page in pagewise_items)
 
         logger.info(f"Extracted {total_count} items across {len(pagewise_items)} pages")
 
@@ -297,15 +867,3 @@ class InvoicesOCRService:
             pagewise_line_items=pagewise_items,
             total_item_count=total_count
         )
-    
-    def _cleanup(self, document_path: str, image_paths: List[str]):
-        """Clean up temporary files"""
-        try:
-            if os.path.exists(document_path):
-                os.remove(document_path)
-            
-            for image_path in image_paths:
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-        except Exception:
-            pass  # Ignore cleanup errors
@@ -1,97 +1,375 @@
 """
 LLM Wrapper for multiple providers (Gemini and OpenAI)
 """
+import asyncio
 import base64
-import json
+import hashlib
+import importlib.util
 import logging
-from typing import List, Dict, Any
-from pathlib import Path
-
-from config.config import settings
+from collections import Counter
+from functools import lru_cache
+from itertools import chain
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple, Union
+
+import httpx
+import orjson
+
+from config.config import get_settings
+from services.invoices_ocr_prompts import (
+    get_dynamic_prompt_suffix,
+    get_json_schema,
+    thaw_json_schema,
+    validate_response,
+    SchemaValidationError
+)
 from utils.json_repair import repair_json, validate_invoice_structure, get_empty_invoice_structure
-from utils.retry import RetryConfig, retry_with_config
+from utils.rate_limit import AsyncTokenBucket
+from utils.result_cache import ResultCache, document_cache_key
+from utils.retry import RetryConfig, retry_with_config_async
 
 logger = logging.getLogger(__name__)
 
 
+def _page_hint(first_page: int, last_page: int, total_pages: int) -> str:
+    """Describe which pages of the document a request covers"""
+    if first_page == last_page:
+        return f"page {first_page} of {total_pages}"
+    return f"pages {first_page}-{last_page} of {total_pages}"
+
+
+async def _parse_model_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse the JSON a model returned, repairing it if needed
+
+    Well-formed output is parsed directly; only malformed output goes
+    through the (regex-heavy) repair strategies, in a worker thread so
+    other chunks' requests keep progressing.
+
+    Args:
+        text: Raw model output
+
+    Returns:
+        Parsed JSON, or None if it could not be repaired
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError as e:
+        return await asyncio.to_thread(repair_json, text, parse_error=e)
+
+
+# A page image: path to an image file (JPEG, or PNG / WebP as uploaded),
+# or the encoded image bytes themselves
+PageImage = Union[str, bytes]
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+GEMINI_API_URL = "https://generativelanguage.googleapis.com"
+
+# Pooled connections to the provider APIs, so chunks reuse one TLS session
+# (and share one multiplexed connection over HTTP/2, which needs the optional
+# "h2" package from httpx[http2])
+LLM_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+LLM_CONNECT_TIMEOUT = 10.0
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# HTTP statuses worth retrying besides 5xx (request timeout, rate limited)
+RETRYABLE_STATUS_CODES = frozenset({408, 429})
+
+# Rough input-token cost used for tokens/min limiting: a rendered page
+# image, and characters per prompt token
+ESTIMATED_IMAGE_TOKENS = 1500
+CHARS_PER_TOKEN = 4
+
+# Appended to the prompt for Gemini - make it clear we want DATA not the schema
+_GEMINI_OUTPUT_INSTRUCTIONS = """IMPORTANT: Extract the ACTUAL DATA from the invoice image and return it in JSON format.
+
+Example of the expected JSON structure (with actual data from the invoice):
+{
+  "pagewise_line_items": [
+    {
+      "page_no": "1",
+      "page_type": "Bill Detail",
+      "bill_items": [
+        {
+          "item_name": "Product Name Here",
+          "item_quantity": 2.0,
+          "item_rate": 100.0,
+          "item_amount": 200.0
+        }
+      ]
+    }
+  ]
+}
+
+Return ONLY the JSON with the EXTRACTED DATA from the invoice. No markdown formatting, no code blocks, no schema definitions."""
+
+# Appended to the prompt for Ollama (simpler for local models)
+_OLLAMA_OUTPUT_INSTRUCTIONS = """INSTRUCTIONS:
+1. Look at the image carefully.
+2. Extract the table of items/products/services.
+3. For each row, extract: Description (item_name), Quantity (item_quantity), Rate/Price (item_rate), and Amount (item_amount).
+4. If quantity is missing, assume 1.
+5. Determine the page type: "Bill Detail", "Final Bill", or "Pharmacy".
+6. Return the data as a JSON object.
+
+REQUIRED JSON FORMAT:
+{
+  "pagewise_line_items": [
+    {
+      "page_no": "1",
+      "page_type": "Bill Detail",
+      "bill_items": [
+        {
+          "item_name": "Example Item",
+          "item_quantity": 1.0,
+          "item_rate": 100.0,
+          "item_amount": 100.0
+        }
+      ]
+    }
+  ]
+}
+
+Return ONLY the JSON object. No markdown formatting, no code blocks."""
+
+
+def _openai_response_format(json_schema: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Build the OpenAI structured-output response_format for a schema
+
+    Args:
+        json_schema: JSON schema mapping
+
+    Returns:
+        response_format payload (plain JSON types, as the SDK requires)
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "invoice_extraction",
+            "schema": thaw_json_schema(json_schema),
+            "strict": True
+        }
+    }
+
+
+# Structured-output payload for the shared invoice schema, built once; the
+# SDK only serializes it, so the same object is passed to every call
+_OPENAI_RESPONSE_FORMAT = _openai_response_format(get_json_schema())
+
+
+@lru_cache(maxsize=8)
+def _gemini_prompt_part(prompt: str) -> bytes:
+    """Encode the Gemini text part for a static prompt once"""
+    return orjson.dumps({"text": f"{prompt}\n\n{_GEMINI_OUTPUT_INSTRUCTIONS}"})
+
+
+@lru_cache(maxsize=8)
+def _ollama_prompt_json(prompt: str) -> bytes:
+    """Encode the Ollama prompt for a static prompt once, as a JSON string literal"""
+    return orjson.dumps(f"{prompt}\n\n{_OLLAMA_OUTPUT_INSTRUCTIONS}")
+
+
+@lru_cache(maxsize=8)
+def _prompt_cache_key(prompt: str) -> str:
+    """Stable key identifying a static prompt for provider-side prompt caching"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _image_sha256(image: PageImage) -> bytes:
+    """SHA-256 digest of a page image's encoded bytes"""
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return hashlib.file_digest(f, "sha256").digest()
+    return hashlib.sha256(image).digest()
+
+
+def _image_mime(data: bytes) -> str:
+    """MIME type of an encoded image, from its magic bytes (JPEG unless recognized)"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _read_image(image: PageImage) -> bytes:
+    """Encoded bytes of a page image"""
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return f.read()
+    return image
+
+
+def _read_image_b64(image: PageImage) -> Tuple[str, bytes]:
+    """
+    MIME type and base64 encoding of a page image (ASCII, safe inside a JSON string)
+
+    Each page is encoded exactly once per document: chunks never share
+    pages, and a chunk's request is built before its retry loop. Page
+    files live in per-request temp directories, so an encoding cache
+    would never be hit.
+    """
+    data = _read_image(image)
+    return _image_mime(data), base64.b64encode(data)
+
+
+def _gemini_inline_part(image: PageImage) -> bytes:
+    """Encode a page image as a Gemini inline_data part"""
+    mime_type, data = _read_image_b64(image)
+    return b'{"inline_data":{"mime_type":"' + mime_type.encode("ascii") + b'","data":"' + data + b'"}}'
+
+
 class LLMWrapper:
     """Unified interface for multiple LLM providers"""
     
-    def __init__(self):
-        self.provider = settings.llm_provider
-        self.temperature = settings.llm_temperature
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        """
+        Initialize the provider client
+
+        Args:
+            http_client: Client for all provider requests; the wrapper
+                creates (and closes in `aclose`) its own when omitted
+        """
+        self.settings = get_settings()
+        self._owns_http_client = http_client is None
+        self.http_client = http_client or httpx.AsyncClient(
+            timeout=httpx.Timeout(self.settings.llm_timeout, connect=LLM_CONNECT_TIMEOUT),
+            http2=HTTP2_AVAILABLE,
+            limits=LLM_LIMITS
+        )
+        self.provider = self.settings.llm_provider
+        self.temperature = self.settings.llm_temperature
 
-        # Configure retry settings
+        # Parsed responses per chunk (stored serialized, so callers can
+        # mutate the results they get back)
+        self.chunk_cache: ResultCache[bytes] = ResultCache(
+            self.settings.chunk_cache_size if self.settings.enable_result_cache else 0
+        )
+
+        # Provider quotas (shared by all documents in this worker)
+        self.request_limiter = (
+            AsyncTokenBucket(self.settings.llm_requests_per_minute)
+            if self.settings.llm_requests_per_minute > 0 else None
+        )
+        self.token_limiter = (
+            AsyncTokenBucket(self.settings.llm_tokens_per_minute)
+            if self.settings.llm_tokens_per_minute > 0 else None
+        )
+
+        # Configure retry settings (only transient failures are retried)
         self.retry_config = RetryConfig(
             max_retries=3,
             initial_delay=2.0,
             max_delay=10.0,
-            exponential_base=2.0
+            exponential_base=2.0,
+            retry_on=self._is_retryable
         )
+        self._transient_errors: Tuple[type, ...] = (httpx.TransportError, SchemaValidationError)
+        self._status_errors: Tuple[type, ...] = (httpx.HTTPStatusError,)
 
         if self.provider == "gemini":
             import google.generativeai as genai
-            genai.configure(api_key=settings.gemini_api_key)
-            self.model_name = settings.gemini_model
+            genai.configure(api_key=self.settings.gemini_api_key)
+            self.model_name = self.settings.gemini_model
             # Use the model name directly without GenerativeModel wrapper to avoid v1beta
             self.genai = genai
             self.client = None  # We'll call generate_content differently
         elif self.provider == "openai":
-            from openai import OpenAI
-            self.client = OpenAI(api_key=settings.openai_api_key)
-            self.model_name = settings.openai_model
+            from openai import (
+                APIConnectionError,
+                APIStatusError,
+                AsyncOpenAI,
+                InternalServerError,
+                RateLimitError
+            )
+            # Shares the pooled (HTTP/2) client, so chunks reuse its connections.
+            # The SDK's own retries are off: retry_config is the only backoff layer
+            self.client = AsyncOpenAI(
+                api_key=self.settings.openai_api_key,
+                http_client=self.http_client,
+                timeout=self.http_client.timeout,
+                max_retries=0
+            )
+            self._transient_errors += (APIConnectionError, RateLimitError, InternalServerError)
+            self._status_errors += (APIStatusError,)
+            self.model_name = self.settings.openai_model
         elif self.provider == "ollama":
             # Ollama uses HTTP API, no special client needed
-            self.base_url = settings.ollama_base_url
-            self.model_name = settings.ollama_model
+            self.base_url = self.settings.ollama_base_url
+            self.model_name = self.settings.ollama_model
         else:
             raise ValueError(f"Unsupported LLM provider: {self.provider}")
+
+    def _is_retryable(self, exception: Exception) -> bool:
+        """
+        Check whether a failed provider call is worth retrying
+
+        Connection errors, timeouts, 408/429/5xx responses and responses that
+        break the JSON schema are retried; auth, bad-request and programming
+        errors would fail the same way again.
+
+        Args:
+            exception: Exception the call raised
+
+        Returns:
+            True if the call should be retried
+        """
+        if isinstance(exception, self._transient_errors):
+            return True
+        if isinstance(exception, self._status_errors):
+            status = exception.response.status_code
+            return status in RETRYABLE_STATUS_CODES or status >= 500
+        return False
+
+    async def aclose(self) -> None:
+        """Close the HTTP client if the wrapper owns it (the OpenAI client shares it)"""
+        if self._owns_http_client:
+            await self.http_client.aclose()
     
-    def process_with_structured_output(
+    async def process_with_structured_output(
         self,
-        image_paths: List[str],
+        images: List[PageImage],
         prompt: str,
-        json_schema: Dict[str, Any]
+        json_schema: Mapping[str, Any]
     ) -> tuple[Dict[str, Any], Dict[str, int]]:
         """
         Process images with LLM and return structured JSON output with token usage
         Uses chunking for large documents to avoid truncation
 
         Args:
-            image_paths: List of paths to image files
+            images: Page images (image file paths or encoded bytes)
             prompt: Text prompt for the LLM
             json_schema: JSON schema for structured output
 
         Returns:
             Tuple of (parsed JSON response, token usage dict)
         """
-        # For large documents, process in chunks to avoid truncation
-        max_images_per_batch = settings.pages_per_chunk
+        # For large documents, process in chunks to avoid truncation; with
+        # pages_per_chunk=0 every page goes into one request (the prompt is
+        # paid for once), capped at the page limit
+        max_images_per_batch = self.settings.pages_per_chunk or self.settings.max_pages_per_invoice
 
-        if len(image_paths) > max_images_per_batch:
-            logger.info(f"Processing {len(image_paths)} images in chunks of {max_images_per_batch}")
-            return self._process_in_chunks(image_paths, prompt, json_schema, max_images_per_batch)
+        if len(images) > max_images_per_batch:
+            logger.info(f"Processing {len(images)} images in chunks of {max_images_per_batch}")
+            return await self._process_in_chunks(images, prompt, json_schema, max_images_per_batch)
 
         # For small documents, process directly
-        if self.provider == "gemini":
-            return self._call_gemini(image_paths, prompt, json_schema)
-        elif self.provider == "openai":
-            return self._call_openai(image_paths, prompt, json_schema)
-        elif self.provider == "ollama":
-            return self._call_ollama(image_paths, prompt, json_schema)
+        page_hint = _page_hint(1, len(images), len(images))
+        return await self._call_with_retry(images, prompt, json_schema, page_hint)
 
-    def _process_in_chunks(
+    async def _process_in_chunks(
         self,
-        image_paths: List[str],
+        images: List[PageImage],
         prompt: str,
-        json_schema: Dict[str, Any],
+        json_schema: Mapping[str, Any],
         chunk_size: int
     ) -> tuple[Dict[str, Any], Dict[str, int]]:
         """
-        Process images in chunks and combine results
+        Process images in chunks concurrently and combine results
 
         Args:
-            image_paths: List of all image paths
+            images: All page images (image file paths or encoded bytes)
             prompt: Extraction prompt
             json_schema: JSON schema
             chunk_size: Number of images per chunk
@@ -99,43 +377,91 @@ class LLMWrapper:
         Returns:
             Combined results and total token usage
         """
-        all_pagewise_items = []
-        total_tokens = 0
-        total_input_tokens = 0
-        total_output_tokens = 0
+        async def chunks() -> AsyncIterator[List[PageImage]]:
+            for i in range(0, len(images), chunk_size):
+                yield images[i:i + chunk_size]
 
-        # Process in chunks
-        for i in range(0, len(image_paths), chunk_size):
-            chunk = image_paths[i:i + chunk_size]
-            chunk_num = (i // chunk_size) + 1
-            total_chunks = (len(image_paths) + chunk_size - 1) // chunk_size
+        return await self.process_chunk_stream(chunks(), len(images), prompt, json_schema)
 
-            logger.info(f"Processing chunk {chunk_num}/{total_chunks} with {len(chunk)} images")
+    async def process_chunk_stream(
+        self,
+        chunks: AsyncIterator[List[PageImage]],
+        total_pages: int,
+        prompt: str,
+        json_schema: Mapping[str, Any]
+    ) -> tuple[Dict[str, Any], Dict[str, int]]:
+        """
+        Process page chunks as they become available and combine results
 
-            try:
-                if self.provider == "gemini":
-                    result, token_usage = self._call_gemini(chunk, prompt, json_schema)
-                elif self.provider == "openai":
-                    result, token_usage = self._call_openai(chunk, prompt, json_schema)
-                elif self.provider == "ollama":
-                    result, token_usage = self._call_ollama(chunk, prompt, json_schema)
+        Each chunk is sent to the LLM as soon as it is yielded, so the
+        producer (e.g. a PDF renderer) keeps working while earlier chunks
+        are in flight.
 
-                # Accumulate results
-                pagewise_items = result.get("pagewise_line_items", [])
-                all_pagewise_items.extend(pagewise_items)
+        Args:
+            chunks: Consecutive chunks of page images, in document order
+            total_pages: Number of pages in the whole document
+            prompt: Extraction prompt
+            json_schema: JSON schema
 
-                # Accumulate token usage
-                total_tokens += token_usage.get("total_tokens", 0)
-                total_input_tokens += token_usage.get("input_tokens", 0)
-                total_output_tokens += token_usage.get("output_tokens", 0)
+        Returns:
+            Combined results and total token usage
+        """
+        # Chunks are independent network-bound calls; bound how many are in flight
+        semaphore = asyncio.Semaphore(max(1, self.settings.llm_concurrency))
+
+        async def process_chunk(chunk_num: int, first_page: int, chunk: List[PageImage]) -> tuple[Dict[str, Any], Dict[str, int]]:
+            page_hint = _page_hint(first_page, first_page + len(chunk) - 1, total_pages)
+            async with semaphore:
+                logger.info(f"Processing chunk {chunk_num} ({page_hint}) with {len(chunk)} images")
+                return await self._call_with_retry(chunk, prompt, json_schema, page_hint)
+
+        tasks: List[asyncio.Task] = []
+        first_page = 1
+        try:
+            async for chunk in chunks:
+                tasks.append(asyncio.create_task(process_chunk(len(tasks) + 1, first_page, chunk)))
+                first_page += len(chunk)
+        except BaseException:
+            # The producer failed; don't leave chunk requests running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return self._combine_chunk_results(results)
+
+    def _combine_chunk_results(
+        self,
+        results: List[Any]
+    ) -> tuple[Dict[str, Any], Dict[str, int]]:
+        """
+        Merge per-chunk results in document order, skipping failed chunks
 
-                logger.info(f"Chunk {chunk_num} extracted {len(pagewise_items)} pages")
+        Args:
+            results: (result, token usage) tuples or exceptions, in chunk order
 
-            except Exception as e:
-                logger.error(f"Error processing chunk {chunk_num}: {str(e)}")
+        Returns:
+            Combined results and total token usage
+        """
+        # Results are in chunk order, so pages stay in document order
+        successful = []
+        for chunk_num, outcome in enumerate(results, start=1):
+            if isinstance(outcome, BaseException):
+                logger.error(f"Error processing chunk {chunk_num}: {str(outcome)}")
                 # Continue with other chunks
                 continue
 
+            successful.append(outcome)
+            logger.info(f"Chunk {chunk_num} extracted {len(outcome[0].get('pagewise_line_items', []))} pages")
+
+        all_pagewise_items = list(chain.from_iterable(
+            result.get("pagewise_line_items", []) for result, _ in successful
+        ))
+        token_totals: Counter = Counter()
+        for _, token_usage in successful:
+            token_totals.update(token_usage)
+
         # Renumber pages sequentially (1, 2, 3...) instead of using extracted page numbers
         # This handles jumbled/out-of-order invoices
         for idx, page in enumerate(all_pagewise_items):
@@ -149,88 +475,258 @@ class LLMWrapper:
         }
 
         combined_token_usage = {
-            "total_tokens": total_tokens,
-            "input_tokens": total_input_tokens,
-            "output_tokens": total_output_tokens
+            "total_tokens": token_totals["total_tokens"],
+            "input_tokens": token_totals["input_tokens"],
+            "output_tokens": token_totals["output_tokens"]
         }
 
-        logger.info(f"Combined results: {len(all_pagewise_items)} pages, {total_tokens} total tokens")
+        logger.info(f"Combined results: {len(all_pagewise_items)} pages, {token_totals['total_tokens']} total tokens")
 
         return combined_result, combined_token_usage
-    
-    def _call_gemini(
+
+    async def _call_with_retry(
         self,
-        image_paths: List[str],
+        images: List[PageImage],
         prompt: str,
-        json_schema: Dict[str, Any]
+        json_schema: Mapping[str, Any],
+        page_hint: str
     ) -> tuple[Dict[str, Any], Dict[str, int]]:
-        """Call Google Gemini API using REST API directly"""
-        import json
-        import base64
-        import httpx
-        
-        # Encode images to base64
-        image_parts = []
-        for path in image_paths:
-            with open(path, "rb") as f:
-                image_data = base64.b64encode(f.read()).decode('utf-8')
-                image_parts.append({
-                    "inline_data": {
-                        "mime_type": "image/jpeg",
-                        "data": image_data
-                    }
-                })
-        
-        # Add schema to prompt - make it clear we want DATA not the schema
-        schema_prompt = f"""{prompt}
+        """
+        Call the configured provider, retrying with backoff
 
-IMPORTANT: Extract the ACTUAL DATA from the invoice image and return it in JSON format.
+        The request is built once, off the event loop (reading and
+        base64-encoding the pages is disk / CPU work); only the network
+        call is retried. Responses are cached per chunk, keyed by the
+        page images and everything else that goes into the request.
 
-Example of the expected JSON structure (with actual data from the invoice):
-{{
-  "pagewise_line_items": [
-    {{
-      "page_no": "1",
-      "page_type": "Bill Detail",
-      "bill_items": [
-        {{
-          "item_name": "Product Name Here",
-          "item_quantity": 2.0,
-          "item_rate": 100.0,
-          "item_amount": 200.0
-        }}
-      ]
-    }}
-  ]
-}}
+        Args:
+            images: Page images to send in this request
+            prompt: Static extraction prompt, sent before the images
+            json_schema: JSON schema
+            page_hint: Which pages of the document this request covers
 
-Return ONLY the JSON with the EXTRACTED DATA from the invoice. No markdown formatting, no code blocks, no schema definitions."""
-        
-        
-        # Build request payload
-        payload = {
-            "contents": [{
-                "parts": [{"text": schema_prompt}] + image_parts
-            }],
-            "generationConfig": {
+        Returns:
+            Tuple of (parsed JSON response, token usage dict)
+        """
+        prompt_suffix = get_dynamic_prompt_suffix(page_hint)
+        cache_key = None
+        if self.chunk_cache.max_entries > 0:
+            cache_key = await asyncio.to_thread(self._chunk_cache_key, images, prompt, prompt_suffix)
+            cached = self.chunk_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Chunk cache hit ({page_hint}), skipping LLM call")
+                return orjson.loads(cached), {"total_tokens": 0, "input_tokens": 0, "output_tokens": 0}
+
+        result, token_usage = await self._send(images, prompt, prompt_suffix, json_schema)
+
+        # Empty results may come from unparseable output; let those be retried
+        if cache_key is not None and result.get("pagewise_line_items"):
+            self.chunk_cache.put(cache_key, orjson.dumps(result))
+        return result, token_usage
+
+    def _chunk_cache_key(self, images: List[PageImage], prompt: str, prompt_suffix: str) -> str:
+        """Cache key for one chunk request (reads the page images)"""
+        return document_cache_key(
+            b"".join(_image_sha256(image) for image in images),
+            self.provider,
+            self.model_name,
+            str(self.temperature),
+            _prompt_cache_key(prompt),
+            prompt_suffix
+        )
+
+    async def _send(
+        self,
+        images: List[PageImage],
+        prompt: str,
+        prompt_suffix: str,
+        json_schema: Mapping[str, Any]
+    ) -> tuple[Dict[str, Any], Dict[str, int]]:
+        """Build the request for a chunk and send it, retrying with backoff"""
+        # Gemini can reference pages uploaded through the Files API instead
+        # of inlining them as base64
+        files: Optional[List[Dict[str, Any]]] = None
+        if self.provider == "gemini" and self.settings.gemini_upload_files:
+            files = await retry_with_config_async(self.retry_config, self._upload_gemini_files, images)
+
+        try:
+            request = await asyncio.to_thread(
+                self._build_request,
+                images,
+                prompt,
+                prompt_suffix,
+                files
+            )
+            return await retry_with_config_async(
+                self.retry_config,
+                self._call_provider,
+                request,
+                len(images),
+                prompt,
+                json_schema
+            )
+        finally:
+            if files:
+                await self._delete_gemini_files(files)
+
+    def _build_request(
+        self,
+        images: List[PageImage],
+        prompt: str,
+        prompt_suffix: str,
+        files: Optional[List[Dict[str, Any]]] = None
+    ) -> Union[bytes, List[Dict[str, Any]]]:
+        """Build the request for the configured provider (JSON body, or OpenAI chat messages)"""
+        if self.provider == "gemini":
+            return self._gemini_body(images, prompt, prompt_suffix, files)
+        elif self.provider == "openai":
+            return self._openai_messages(images, prompt, prompt_suffix)
+        return self._ollama_body(images, prompt, prompt_suffix)
+
+    async def _call_provider(
+        self,
+        request: Union[bytes, List[Dict[str, Any]]],
+        image_count: int,
+        prompt: str,
+        json_schema: Mapping[str, Any]
+    ) -> tuple[Dict[str, Any], Dict[str, int]]:
+        """Send a single prebuilt request to the configured provider"""
+        # Every attempt (retries included) counts against the provider quota
+        if self.request_limiter is not None:
+            await self.request_limiter.acquire()
+        if self.token_limiter is not None:
+            await self.token_limiter.acquire(
+                len(prompt) // CHARS_PER_TOKEN + image_count * ESTIMATED_IMAGE_TOKENS
+            )
+
+        if self.provider == "gemini":
+            return await self._call_gemini(request, image_count)
+        elif self.provider == "openai":
+            return await self._call_openai(request, prompt, json_schema)
+        elif self.provider == "ollama":
+            return await self._call_ollama(request)
+    
+    def _gemini_body(
+        self,
+        images: List[PageImage],
+        prompt: str,
+        prompt_suffix: str,
+        files: Optional[List[Dict[str, Any]]] = None
+    ) -> bytes:
+        """Build the Gemini request body, inlining the pages unless they were uploaded"""
+        if files is None:
+            image_parts = (_gemini_inline_part(image) for image in images)
+        else:
+            image_parts = (
+                orjson.dumps({"file_data": {"mime_type": file.get("mimeType", "image/jpeg"), "file_uri": file["uri"]}})
+                for file in files
+            )
+
+        # Request body is assembled from pre-encoded JSON fragments so the
+        # prompt is serialized once and the base64 images are never decoded to str
+        return b"".join((
+            b'{"contents":[{"parts":[',
+            # Static instructions first so the provider can reuse the cached prefix
+            _gemini_prompt_part(prompt),
+            b",",
+            b",".join(image_parts),
+            b",",
+            orjson.dumps({"text": prompt_suffix}),
+            b']}],"generationConfig":',
+            orjson.dumps({
                 "temperature": self.temperature,
-                "maxOutputTokens": settings.max_output_tokens
+                "maxOutputTokens": self.settings.max_output_tokens
+            }),
+            b"}",
+        ))
+
+    def _gemini_api_key(self) -> str:
+        """API key the Gemini client was configured with"""
+        return self.genai._client.api_key if hasattr(self.genai, '_client') else self.settings.gemini_api_key
+
+    async def _upload_gemini_file(self, image: PageImage) -> Dict[str, Any]:
+        """
+        Upload one page through the Gemini Files API (resumable protocol)
+
+        Args:
+            image: Page image (file path or bytes)
+
+        Returns:
+            Uploaded file resource (including its "name", "uri" and "mimeType")
+        """
+        data = await asyncio.to_thread(_read_image, image)
+        start = await self.http_client.post(
+            f"{GEMINI_API_URL}/upload/v1beta/files",
+            params={"key": self._gemini_api_key()},
+            content=b'{"file":{"display_name":"invoice-page"}}',
+            headers={
+                **_JSON_HEADERS,
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(len(data)),
+                "X-Goog-Upload-Header-Content-Type": _image_mime(data)
             }
-        }
-        
+        )
+        start.raise_for_status()
+
+        upload = await self.http_client.post(
+            start.headers["x-goog-upload-url"],
+            content=data,
+            headers={"X-Goog-Upload-Offset": "0", "X-Goog-Upload-Command": "upload, finalize"}
+        )
+        upload.raise_for_status()
+        return orjson.loads(upload.content)["file"]
+
+    async def _upload_gemini_files(self, images: List[PageImage]) -> List[Dict[str, Any]]:
+        """
+        Upload a chunk's pages concurrently, in page order
+
+        If any upload fails, the pages already uploaded are deleted again.
+        """
+        results = await asyncio.gather(
+            *(self._upload_gemini_file(image) for image in images),
+            return_exceptions=True
+        )
+        failures = [result for result in results if isinstance(result, BaseException)]
+        if failures:
+            await self._delete_gemini_files([result for result in results if not isinstance(result, BaseException)])
+            raise failures[0]
+        return results
+
+    async def _delete_gemini_files(self, files: List[Dict[str, Any]]) -> None:
+        """Delete uploaded pages (best effort; unused files expire after 48 hours)"""
+        async def delete(file: Dict[str, Any]) -> None:
+            try:
+                response = await self.http_client.delete(
+                    f"{GEMINI_API_URL}/v1beta/{file['name']}",
+                    params={"key": self._gemini_api_key()}
+                )
+                response.raise_for_status()
+            except Exception as e:
+                logger.warning(f"Could not delete uploaded file {file.get('name')}: {str(e)}")
+
+        await asyncio.gather(*(delete(file) for file in files))
+
+    async def _call_gemini(
+        self,
+        body: bytes,
+        image_count: int
+    ) -> tuple[Dict[str, Any], Dict[str, int]]:
+        """Call Google Gemini API using REST API directly"""
         # Call REST API directly (v1, not v1beta)
-        api_key = self.genai._client.api_key if hasattr(self.genai, '_client') else settings.gemini_api_key
-        url = f"https://generativelanguage.googleapis.com/v1/models/{self.model_name}:generateContent?key={api_key}"
+        url = f"{GEMINI_API_URL}/v1/models/{self.model_name}:generateContent?key={self._gemini_api_key()}"
 
         # Use longer timeout for large documents
-        timeout = max(120.0, len(image_paths) * 30.0)
-        logger.info(f"Calling Gemini API with {len(image_paths)} images, timeout={timeout}s")
+        timeout = max(120.0, image_count * 30.0)
+        logger.info(f"Calling Gemini API with {image_count} images, timeout={timeout}s")
 
-        response = httpx.post(url, json=payload, timeout=timeout)
+        response = await self.http_client.post(url, content=body, headers=_JSON_HEADERS, timeout=timeout)
         response.raise_for_status()
-        
-        
-        result = response.json()
+
+        # The envelope is only a few small objects around the model's JSON
+        # text (a single string), so one orjson pass is cheaper than
+        # streaming it through an incremental parser
+        result = orjson.loads(response.content)
         response_text = result['candidates'][0]['content']['parts'][0]['text'].strip()
 
         # Extract token usage from response
@@ -244,10 +740,13 @@ Return ONLY the JSON with the EXTRACTED DATA from the invoice. No markdown forma
         # Log raw response for debugging
         logger.info(f"Raw Gemini response length: {len(response_text)} chars")
         logger.debug(f"Raw Gemini response: {response_text[:500]}")
-        logger.info(f"Token usage: {token_usage}")
+        logger.info(
+            f"Token usage: {token_usage}, "
+            f"cached prompt tokens: {usage_metadata.get('cachedContentTokenCount', 0)}"
+        )
 
         # Use robust JSON repair
-        parsed_json = repair_json(response_text)
+        parsed_json = await _parse_model_json(response_text)
 
         if parsed_json is None:
             logger.error("Failed to parse JSON after all repair attempts")
@@ -265,48 +764,55 @@ Return ONLY the JSON with the EXTRACTED DATA from the invoice. No markdown forma
 
         return parsed_json, token_usage
     
-    def _call_openai(
+    def _openai_messages(
         self,
-        image_paths: List[str],
+        images: List[PageImage],
         prompt: str,
-        json_schema: Dict[str, Any]
-    ) -> tuple[Dict[str, Any], Dict[str, int]]:
-        """Call OpenAI API"""
+        prompt_suffix: str
+    ) -> List[Dict[str, Any]]:
+        """Build the OpenAI chat messages"""
         # Encode images to base64
         image_contents = []
-        for path in image_paths:
-            with open(path, "rb") as f:
-                base64_image = base64.b64encode(f.read()).decode("utf-8")
-                image_contents.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
-                    }
-                })
+        for image in images:
+            mime_type, base64_image = _read_image_b64(image)
+            image_contents.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{mime_type};base64,{base64_image.decode('ascii')}"
+                }
+            })
         
-        # Create messages
+        # Create messages; the static instructions go first, in their own
+        # system message, so OpenAI's automatic prefix caching can reuse them
         messages = [
+            {"role": "system", "content": prompt},
             {
                 "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt}
-                ] + image_contents
+                "content": image_contents + [
+                    {"type": "text", "text": prompt_suffix}
+                ]
             }
         ]
-        
+        return messages
+
+    async def _call_openai(
+        self,
+        messages: List[Dict[str, Any]],
+        prompt: str,
+        json_schema: Mapping[str, Any]
+    ) -> tuple[Dict[str, Any], Dict[str, int]]:
+        """Call OpenAI API"""
         # Call OpenAI with structured output
-        response = self.client.beta.chat.completions.parse(
+        response = await self.client.beta.chat.completions.parse(
             model=self.model_name,
             messages=messages,
             temperature=self.temperature,
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "invoice_extraction",
-                    "schema": json_schema,
-                    "strict": True
-                }
-            }
+            response_format=(
+                _OPENAI_RESPONSE_FORMAT if json_schema is get_json_schema()
+                else _openai_response_format(json_schema)
+            ),
+            # Route requests sharing the static prompt to the same cache
+            extra_body={"prompt_cache_key": _prompt_cache_key(prompt)}
         )
         
         # Extract token usage
@@ -316,76 +822,45 @@ Return ONLY the JSON with the EXTRACTED DATA from the invoice. No markdown forma
             "input_tokens": usage.prompt_tokens,
             "output_tokens": usage.completion_tokens
         }
+        cached_tokens = getattr(usage.prompt_tokens_details, "cached_tokens", None) or 0
+        logger.info(f"Token usage: {token_usage}, cached prompt tokens: {cached_tokens}")
         
-        # Parse response
-        return json.loads(response.choices[0].message.content), token_usage
+        # Parse response; a schema violation raises and the chunk is retried
+        return validate_response(orjson.loads(response.choices[0].message.content)), token_usage
     
-    def _call_ollama(
+    def _ollama_body(
         self,
-        image_paths: List[str],
+        images: List[PageImage],
         prompt: str,
-        json_schema: Dict[str, Any]
-    ) -> tuple[Dict[str, Any], Dict[str, int]]:
+        prompt_suffix: str
+    ) -> bytes:
+        """Build the Ollama request body"""
+        # JSON string literals concatenate by dropping the closing/opening quotes
+        prompt_json = _ollama_prompt_json(prompt)[:-1] + orjson.dumps(f"\n\n{prompt_suffix}")[1:]
+
+        return b"".join((
+            b'{"model":',
+            orjson.dumps(self.model_name),
+            b',"prompt":',
+            prompt_json,
+            b',"images":[',
+            b",".join(b'"' + _read_image_b64(image)[1] + b'"' for image in images),
+            b'],"stream":false,"options":',
+            orjson.dumps({"temperature": self.temperature}),
+            b"}",
+        ))
+
+    async def _call_ollama(self, body: bytes) -> tuple[Dict[str, Any], Dict[str, int]]:
         """Call Ollama API (local LLM)"""
-        import httpx
-        
-        # Encode images to base64
-        images = []
-        for path in image_paths:
-            with open(path, "rb") as f:
-                base64_image = base64.b64encode(f.read()).decode("utf-8")
-                images.append(base64_image)
-        
-        # Add JSON format instructions to prompt (simpler for local models)
-        schema_prompt = f"""{prompt}
-
-INSTRUCTIONS:
-1. Look at the image carefully.
-2. Extract the table of items/products/services.
-3. For each row, extract: Description (item_name), Quantity (item_quantity), Rate/Price (item_rate), and Amount (item_amount).
-4. If quantity is missing, assume 1.
-5. Determine the page type: "Bill Detail", "Final Bill", or "Pharmacy".
-6. Return the data as a JSON object.
-
-REQUIRED JSON FORMAT:
-{{
-  "pagewise_line_items": [
-    {{
-      "page_no": "1",
-      "page_type": "Bill Detail",
-      "bill_items": [
-        {{
-          "item_name": "Example Item",
-          "item_quantity": 1.0,
-          "item_rate": 100.0,
-          "item_amount": 100.0
-        }}
-      ]
-    }}
-  ]
-}}
-
-Return ONLY the JSON object. No markdown formatting, no code blocks."""
-
-        # Call Ollama API
-        payload = {
-            "model": self.model_name,
-            "prompt": schema_prompt,
-            "images": images,
-            "stream": False,
-            "options": {
-                "temperature": self.temperature
-            }
-        }
-        
-        response = httpx.post(
+        response = await self.http_client.post(
             f"{self.base_url}/api/generate",
-            json=payload,
+            content=body,
+            headers=_JSON_HEADERS,
             timeout=120.0
         )
         response.raise_for_status()
         
-        result = response.json()
+        result = orjson.loads(response.content)
         response_text = result.get("response", "")
 
         # Ollama doesn't provide token counts in the same way, estimate or use 0
@@ -401,7 +876,7 @@ Return ONLY the JSON object. No markdown formatting, no code blocks."""
         logger.debug(f"Raw Ollama response: {response_text[:500]}")
 
         # Use robust JSON repair
-        parsed_json = repair_json(response_text)
+        parsed_json = await _parse_model_json(response_text)
 
         if parsed_json is None:
             logger.error("Failed to parse JSON after all repair attempts")
@@ -0,0 +1,3 @@
+"""
+Prompt text resources for invoice OCR
+"""
@@ -2,10 +2,56 @@
 Data validation and cleaning utilities for invoice data
 """
 import logging
-from typing import Dict, Any, List
+import re
+from typing import Dict, Any, List, Optional
+
+from models.models import DEFAULT_PAGE_TYPE, PAGE_TYPES
 
 logger = logging.getLogger(__name__)
 
+# Canonical page type names (hashed lookup), and a case-insensitive lookup
+_VALID_PAGE_TYPES = frozenset(PAGE_TYPES)
+_PAGE_TYPES_BY_LOWER = {page_type.lower(): page_type for page_type in PAGE_TYPES}
+
+# Pharmacy quantity written in front of the item name: "3 x Igurat 25",
+# "20 caps Brilamox", "2x Dolo 650", "5 tabs Paracetamol"
+QUANTITY_PREFIX_RE = re.compile(
+    r"^\s*(?P<qty>\d+(?:\.\d+)?)\s*(?:x|caps?|tabs?|units?)\s+(?P<name>.+)$",
+    re.IGNORECASE
+)
+
+
+# Discount / total rows that are not billable items:
+# - strong keywords (very specific to non-billable rows) match anywhere
+# - tax / total keywords only match when the name is EXACTLY the keyword or
+#   starts/ends with it, so "MEDICINE GST" is kept but "GST" or "TOTAL GST"
+#   are filtered
+# Both are compiled into one pattern, so each name is scanned once. The
+# keywords are kept as a flat alternation: factoring out shared prefixes
+# (SUB[ -]?TOTAL, ROUND(?: OFF|ING), ...) measured slower with re.
+_STRONG_KEYWORDS = (
+    'DISCOUNT', 'SUBTOTAL', 'SUB TOTAL', 'SUB-TOTAL',
+    'GRAND TOTAL', 'NET TOTAL', 'AMOUNT TOTAL',
+    'ROUND OFF', 'ROUNDING'
+)
+_EXACT_KEYWORDS = ('GST', 'CGST', 'SGST', 'IGST', 'TAX', 'TOTAL')
+NON_BILLABLE_RE = re.compile(
+    "|".join(map(re.escape, _STRONG_KEYWORDS))
+    + r"|^(?:{0})(?:[ :]|\Z)|[ :](?:{0})\Z".format("|".join(_EXACT_KEYWORDS))
+)
+
+
+class _ControlToSpaceTable(dict):
+    """str.translate table mapping non-printable characters to a space, filled in as characters are seen"""
+
+    def __missing__(self, codepoint: int) -> int:
+        mapped = codepoint if chr(codepoint).isprintable() else 0x20
+        self[codepoint] = mapped
+        return mapped
+
+
+_CONTROL_TO_SPACE = _ControlToSpaceTable()
+
 
 def clean_item_name(name: str) -> str:
     """
@@ -20,19 +66,21 @@ def clean_item_name(name: str) -> str:
     if not isinstance(name, str):
         return str(name)
 
-    # Replace control characters with spaces
-    cleaned = ''.join(char if char.isprintable() or char in ['\n', '\t'] else ' ' for char in name)
-
-    # Replace newlines and tabs with spaces
-    cleaned = cleaned.replace('\n', ' ').replace('\t', ' ')
+    # Common case: nothing to replace, only whitespace to collapse and trim
+    if name.isprintable():
+        return ' '.join(name.split())
 
-    # Replace multiple spaces with single space
-    cleaned = ' '.join(cleaned.split())
+    # Replace control characters (including newlines and tabs) with spaces,
+    # then collapse whitespace and trim
+    return ' '.join(name.translate(_CONTROL_TO_SPACE).split())
 
-    # Trim
-    cleaned = cleaned.strip()
 
-    return cleaned
+def _parse_number(value: Any) -> Optional[float]:
+    """Parse a numeric field (strings may contain commas), or None if it is not a number"""
+    try:
+        return float(value.replace(',', '') if isinstance(value, str) else value)
+    except (ValueError, TypeError):
+        return None
 
 
 def validate_numeric_field(value: Any, field_name: str, default: float = 0.0) -> float:
@@ -47,22 +95,20 @@ def validate_numeric_field(value: Any, field_name: str, default: float = 0.0) ->
     Returns:
         Validated float value
     """
+    # Parsed in this frame rather than through _parse_number: this runs for
+    # every numeric field of every item
     try:
         # Handle strings with commas
-        if isinstance(value, str):
-            value = value.replace(',', '')
-
-        float_value = float(value)
-
-        # Check for negative values (shouldn't happen in invoices)
-        if float_value < 0:
-            float_value = abs(float_value)
-
-        return float_value
-
+        float_value = float(value.replace(',', '') if isinstance(value, str) else value)
     except (ValueError, TypeError):
         return default
 
+    # Check for negative values (shouldn't happen in invoices)
+    if float_value < 0:
+        float_value = abs(float_value)
+
+    return float_value
+
 
 def is_discount_or_total_row(item_name: str) -> bool:
     """
@@ -79,36 +125,18 @@ def is_discount_or_total_row(item_name: str) -> bool:
 
     name_upper = item_name.upper().strip()
 
-    # Strong keywords that should always filter (very specific to non-billable rows)
-    strong_keywords = [
-        'DISCOUNT', 'SUBTOTAL', 'SUB TOTAL', 'SUB-TOTAL',
-        'GRAND TOTAL', 'NET TOTAL', 'AMOUNT TOTAL',
-        'ROUND OFF', 'ROUNDING'
-    ]
-
-    for keyword in strong_keywords:
-        if keyword in name_upper:
-            logger.debug(f"Filtering out non-billable row: {item_name} (matched keyword: {keyword})")
-            return True
-
-    # Exact match keywords (filter only if the name is EXACTLY or PRIMARILY this)
-    # This prevents filtering "MEDICINE GST" but filters "GST" or "TOTAL GST"
-    exact_keywords = ['GST', 'CGST', 'SGST', 'IGST', 'TAX', 'TOTAL']
-
-    # Check if name is exactly one of these keywords or starts/ends with them
-    for keyword in exact_keywords:
-        # Exact match
-        if name_upper == keyword:
-            logger.debug(f"Filtering out non-billable row: {item_name} (exact match: {keyword})")
-            return True
-        # Starts with keyword followed by space or punctuation
-        if name_upper.startswith(keyword + ' ') or name_upper.startswith(keyword + ':'):
-            logger.debug(f"Filtering out non-billable row: {item_name} (starts with: {keyword})")
-            return True
-        # Ends with space/punctuation followed by keyword
-        if name_upper.endswith(' ' + keyword) or name_upper.endswith(':' + keyword):
-            logger.debug(f"Filtering out non-billable row: {item_name} (ends with: {keyword})")
-            return True
+    # Every keyword above contains one of these words and almost no billable
+    # item does, so a few substring scans skip the regex for most names
+    if not (
+        'TOTAL' in name_upper or 'GST' in name_upper or 'TAX' in name_upper
+        or 'ROUND' in name_upper or 'DISCOUNT' in name_upper
+    ):
+        return False
+
+    match = NON_BILLABLE_RE.search(name_upper)
+    if match:
+        logger.debug(f"Filtering out non-billable row: {item_name} (matched: {match.group(0).strip(' :')})")
+        return True
 
     return False
 
@@ -123,45 +151,83 @@ def validate_bill_item(item: Dict[str, Any]) -> Dict[str, Any]:
     Returns:
         Validated and cleaned bill item
     """
-    validated = {}
+    return _build_bill_item(item, _parse_number(item.get('item_amount', 0.0)))
 
-    # Clean item name
-    validated['item_name'] = clean_item_name(item.get('item_name', 'Unknown Item'))
+
+def _build_bill_item(item: Dict[str, Any], raw_amount: Optional[float]) -> Dict[str, Any]:
+    """
+    Validate and clean a bill item whose amount was already parsed
+
+    Args:
+        item: Raw bill item data
+        raw_amount: Parsed item_amount (before abs()), or None if it is not a number
+
+    Returns:
+        Validated and cleaned bill item
+    """
+    item_name = clean_item_name(item.get('item_name', 'Unknown Item'))
 
     # Validate numeric fields
-    validated['item_quantity'] = validate_numeric_field(
-        item.get('item_quantity', 1.0),
-        'item_quantity',
-        default=1.0
-    )
-
-    validated['item_rate'] = validate_numeric_field(
-        item.get('item_rate', 0.0),
-        'item_rate',
-        default=0.0
-    )
-
-    validated['item_amount'] = validate_numeric_field(
-        item.get('item_amount', 0.0),
-        'item_amount',
-        default=0.0
-    )
+    item_quantity = validate_numeric_field(item.get('item_quantity', 1.0), 'item_quantity', default=1.0)
+    item_rate = validate_numeric_field(item.get('item_rate', 0.0), 'item_rate', default=0.0)
+    if raw_amount is None:
+        item_amount = 0.0
+    else:
+        item_amount = abs(raw_amount) if raw_amount < 0 else raw_amount
 
     # Validate calculation: item_amount should be item_quantity * item_rate
     # Allow for small rounding errors
-    expected_amount = validated['item_quantity'] * validated['item_rate']
-    actual_amount = validated['item_amount']
-
-    if abs(expected_amount - actual_amount) > 0.01 and expected_amount > 0:
-        logger.debug(
-            f"Amount mismatch for '{validated['item_name']}': "
-            f"expected {expected_amount}, got {actual_amount}"
-        )
+    expected_amount = item_quantity * item_rate
+
+    if abs(expected_amount - item_amount) > 0.01 and expected_amount > 0:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Amount mismatch for '{item_name}': "
+                f"expected {expected_amount}, got {item_amount}"
+            )
         # Use the provided amount if available, otherwise calculate
-        if actual_amount == 0.0 and expected_amount > 0:
-            validated['item_amount'] = expected_amount
+        if item_amount == 0.0:
+            item_amount = expected_amount
+
+    return {
+        'item_name': item_name,
+        'item_quantity': item_quantity,
+        'item_rate': item_rate,
+        'item_amount': item_amount
+    }
 
-    return validated
+
+def apply_quantity_prefix(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Move a pharmacy quantity prefix from the item name into item_quantity
+
+    The quantity is only taken from the prefix when the LLM left it at 1,
+    e.g. "3 x Igurat 25" for 942.00 becomes name "Igurat 25", quantity 3.0,
+    rate 314.0. If the quantity already matches the prefix, only the name
+    is cleaned.
+
+    Args:
+        item: Validated bill item (modified in place)
+
+    Returns:
+        The same bill item
+    """
+    match = QUANTITY_PREFIX_RE.match(item['item_name'])
+    if not match:
+        return item
+
+    quantity = float(match.group('qty'))
+    if quantity <= 0:
+        return item
+
+    if item['item_quantity'] == quantity:
+        item['item_name'] = match.group('name').strip()
+    elif item['item_quantity'] == 1.0 and item['item_amount'] > 0:
+        logger.debug(f"Applying quantity prefix to '{item['item_name']}': qty={quantity}")
+        item['item_quantity'] = quantity
+        item['item_name'] = match.group('name').strip()
+        item['item_rate'] = round(item['item_amount'] / quantity, 2)
+    return item
 
 
 def validate_page_type(page_type: str) -> str:
@@ -174,24 +240,16 @@ def validate_page_type(page_type: str) -> str:
     Returns:
         Valid page type (always one of: "Bill Detail", "Final Bill", "Pharmacy")
     """
-    valid_types = ["Bill Detail", "Final Bill", "Pharmacy"]
-
     # Handle null or empty
     if not page_type:
-        return "Bill Detail"
+        return DEFAULT_PAGE_TYPE
 
-    # Exact match
-    if page_type in valid_types:
+    # Exact match (LLM JSON may hold unhashable values here)
+    if isinstance(page_type, str) and page_type in _VALID_PAGE_TYPES:
         return page_type
 
-    # Try case-insensitive match
-    page_type_str = str(page_type).strip()
-    for valid_type in valid_types:
-        if page_type_str.lower() == valid_type.lower():
-            return valid_type
-
-    # Default to "Bill Detail"
-    return "Bill Detail"
+    # Try case-insensitive match, defaulting to "Bill Detail"
+    return _PAGE_TYPES_BY_LOWER.get(str(page_type).strip().lower(), DEFAULT_PAGE_TYPE)
 
 
 def validate_and_clean_invoice_data(data: Dict[str, Any]) -> Dict[str, Any]:
@@ -224,7 +282,7 @@ def validate_and_clean_invoice_data(data: Dict[str, Any]) -> Dict[str, Any]:
 
         validated_page = {
             "page_no": str(page_data.get("page_no", "1")),
-            "page_type": validate_page_type(page_data.get("page_type", "Bill Detail")),
+            "page_type": validate_page_type(page_data.get("page_type", DEFAULT_PAGE_TYPE)),
             "bill_items": []
         }
 
@@ -233,34 +291,37 @@ def validate_and_clean_invoice_data(data: Dict[str, Any]) -> Dict[str, Any]:
         if not isinstance(bill_items, list):
             bill_items = []
 
+        is_pharmacy = validated_page['page_type'] == "Pharmacy"
+        add_item = validated_page['bill_items'].append
+
+        # Single pass per item: the amount is parsed once, and rows that are
+        # filtered out by amount are dropped before the item is built
         for item in bill_items:
             if not isinstance(item, dict):
                 continue
 
-            validated_item = validate_bill_item(item)
+            # Skip items with negative amounts (usually discounts)
+            # Note: We check the raw amount before abs() is applied in validation;
+            # if we can't parse it, let it through and rely on name-based filtering
+            raw_amount = _parse_number(item.get('item_amount', 0.0))
+            if raw_amount is not None and raw_amount < 0:
+                logger.debug(f"Filtering out item with negative amount: {item.get('item_name')} (amount: {raw_amount})")
+                continue
+
+            validated_item = _build_bill_item(item, raw_amount)
+
+            # Fix quantity prefixes the LLM left in pharmacy item names
+            if is_pharmacy:
+                apply_quantity_prefix(validated_item)
 
             # Skip discount/total rows
-            if is_discount_or_total_row(validated_item['item_name']):
+            item_name = validated_item['item_name']
+            if is_discount_or_total_row(item_name):
                 continue
 
-            # Skip items with negative amounts (usually discounts)
-            # Note: We check the raw amount before abs() is applied in validation
-            raw_amount = item.get('item_amount', 0)
-            try:
-                if isinstance(raw_amount, str):
-                    raw_amount = float(raw_amount.replace(',', ''))
-                else:
-                    raw_amount = float(raw_amount)
-
-                if raw_amount < 0:
-                    logger.debug(f"Filtering out item with negative amount: {validated_item['item_name']} (amount: {raw_amount})")
-                    continue
-            except (ValueError, TypeError):
-                pass  # If we can't parse, let it through and rely on name-based filtering
-
             # Only add items with valid names
-            if validated_item['item_name'] and validated_item['item_name'] != 'Unknown Item':
-                validated_page['bill_items'].append(validated_item)
+            if item_name and item_name != 'Unknown Item':
+                add_item(validated_item)
 
         # Only add pages with items
         if validated_page['bill_items']:
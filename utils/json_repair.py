@@ -6,8 +6,81 @@ import re
 import logging
 from typing import Dict, Any, Optional
 
+import orjson
+
+try:
+    import json5  # Optional, more lenient last-resort parser
+except ImportError:
+    json5 = None
+
+try:
+    import json_repair as json_repair_lib  # Single-pass tolerant parser (requirements.txt)
+except ImportError:
+    json_repair_lib = None
+
 logger = logging.getLogger(__name__)
 
+# Markdown code fences around the JSON ("```json" first, then bare "```")
+JSON_FENCE_RE = re.compile(r'```json\s*')
+FENCE_RE = re.compile(r'```\s*')
+
+# Raw control characters not already escaped (newlines that close a
+# structure are left alone)
+UNESCAPED_NEWLINE_RE = re.compile(r'(?<!\\)\n(?![}\]])')
+UNESCAPED_CR_RE = re.compile(r'(?<!\\)\r')
+UNESCAPED_TAB_RE = re.compile(r'(?<!\\)\t')
+
+# Everything up to the next brace outside a string literal (group 1), or to
+# the end of the text. Possessive/atomic so a scan never backtracks, and an
+# unterminated quote is skipped like any other character
+JSON_BRACE_RE = re.compile(r'(?>[^{}"]++|"[^"\\]*+(?:\\.[^"\\]*+)*+"|")*+(?:([{}])|\Z)')
+
+# Complete string literals (an unterminated one at the end is left alone)
+STRING_LITERAL_RE = re.compile(r'"[^"\\]*+(?:\\.[^"\\]*+)*+"')
+
+
+def _stdlib_may_accept(text: str, error: json.JSONDecodeError) -> bool:
+    """
+    Check whether the stdlib parser could accept text that orjson rejected
+
+    It only differs from orjson on NaN/Infinity literals, numbers too large
+    for a double and lone surrogate escapes; any other orjson error is a
+    real syntax error, so retrying with the slower parser is pointless.
+
+    Args:
+        text: JSON string orjson failed to parse
+        error: The orjson error
+
+    Returns:
+        True if a json.loads retry is worth it
+    """
+    # orjson reports a NaN/Infinity literal at the literal itself (for
+    # -Infinity, just after the minus sign)
+    if text.startswith(("NaN", "Infinity"), error.pos):
+        return True
+    return "infinity" in error.msg or "surrogate" in error.msg
+
+
+def _loads(text: str) -> Any:
+    """
+    Parse JSON with orjson, falling back to the stdlib parser where it differs
+
+    orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers only
+    need to catch the latter.
+
+    Args:
+        text: JSON string
+
+    Returns:
+        Parsed value
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError as e:
+        if not _stdlib_may_accept(text, e):
+            raise
+        return json.loads(text)
+
 
 def clean_json_string(text: str) -> str:
     """
@@ -20,8 +93,8 @@ def clean_json_string(text: str) -> str:
         Cleaned JSON string
     """
     # Remove markdown code blocks
-    text = re.sub(r'```json\s*', '', text)
-    text = re.sub(r'```\s*', '', text)
+    text = JSON_FENCE_RE.sub('', text)
+    text = FENCE_RE.sub('', text)
 
     # Remove leading/trailing whitespace
     text = text.strip()
@@ -39,19 +112,23 @@ def extract_json_object(text: str) -> Optional[str]:
     Returns:
         Extracted JSON string or None
     """
-    # Try to find the outermost JSON object
-    brace_count = 0
-    start_idx = -1
+    # Try to find the outermost JSON object; the regex engine does the
+    # scanning, so only braces reach Python
+    start_idx = text.find('{')
+    if start_idx == -1:
+        return None
 
-    for i, char in enumerate(text):
-        if char == '{':
-            if start_idx == -1:
-                start_idx = i
+    brace_count = 0
+    for match in JSON_BRACE_RE.finditer(text, start_idx):
+        brace = match.group(1)
+        if brace is None:
+            break
+        if brace == '{':
             brace_count += 1
-        elif char == '}':
+        else:
             brace_count -= 1
-            if brace_count == 0 and start_idx != -1:
-                return text[start_idx:i+1]
+            if brace_count == 0:
+                return text[start_idx:match.end()]
 
     return None
 
@@ -69,12 +146,6 @@ def fix_truncated_json(text: str) -> str:
     # Remove markdown code blocks first
     text = clean_json_string(text)
 
-    # Count open/close braces and brackets
-    open_braces = text.count('{')
-    close_braces = text.count('}')
-    open_brackets = text.count('[')
-    close_brackets = text.count(']')
-
     # Find the last valid position
     # Look for the last complete item before truncation
     lines = text.split('\n')
@@ -95,11 +166,12 @@ def fix_truncated_json(text: str) -> str:
         if text.rstrip().endswith(','):
             text = text.rstrip()[:-1]
 
-    # Now close any open structures
-    open_braces = text.count('{')
-    close_braces = text.count('}')
-    open_brackets = text.count('[')
-    close_brackets = text.count(']')
+    # Now close any open structures, ignoring braces inside string values
+    structure = STRING_LITERAL_RE.sub('""', text)
+    open_braces = structure.count('{')
+    close_braces = structure.count('}')
+    open_brackets = structure.count('[')
+    close_brackets = structure.count(']')
 
     # Close brackets first, then braces
     while close_brackets < open_brackets:
@@ -126,36 +198,25 @@ def fix_unterminated_strings(text: str) -> str:
     # First try to fix truncation
     text = fix_truncated_json(text)
 
-    # Count quotes to detect unterminated strings
-    # This is a simple heuristic and may not work for all cases
-    lines = text.split('\n')
-    fixed_lines = []
+    # A line with an odd number of unescaped quotes leaves a string open.
+    # This is a simple heuristic and may not work for all cases; lines of
+    # only braces/brackets have no quotes, so they are always kept as is
+    return '\n'.join([
+        _close_string(line) if (line.count('"') - line.count('\\"')) % 2 else line
+        for line in text.split('\n')
+    ])
 
-    for line in lines:
-        # Skip if line is just braces or brackets
-        if line.strip() in ['{', '}', '[', ']', ',']:
-            fixed_lines.append(line)
-            continue
 
-        # Check if line has unterminated string (odd number of unescaped quotes)
-        # This is a simplification - proper fix would need a full parser
-        quote_count = line.count('"') - line.count('\\"')
-
-        if quote_count % 2 != 0:
-            # Try to close the string
-            if line.rstrip().endswith(','):
-                line = line.rstrip()[:-1] + '\",'
-            elif line.rstrip().endswith('}') or line.rstrip().endswith(']'):
-                last_quote = line.rfind('"')
-                if last_quote > 0:
-                    line = line[:last_quote] + '\"' + line[last_quote+1:]
-            else:
-                # Just close the string
-                line = line.rstrip() + '\"'
-
-        fixed_lines.append(line)
-
-    return '\n'.join(fixed_lines)
+def _close_string(line: str) -> str:
+    """Close the string left open on a line"""
+    stripped = line.rstrip()
+    if stripped.endswith(','):
+        return stripped[:-1] + '\",'
+    if stripped.endswith('}') or stripped.endswith(']'):
+        # The quote before the bracket is kept as it is
+        return line
+    # Just close the string
+    return stripped + '\"'
 
 
 def escape_control_characters(text: str) -> str:
@@ -170,20 +231,26 @@ def escape_control_characters(text: str) -> str:
     """
     # Replace unescaped newlines in strings
     # This is a simple approach - may need refinement
-    text = re.sub(r'(?<!\\)\n(?![}\]])', '\\\\n', text)
-    text = re.sub(r'(?<!\\)\r', '\\\\r', text)
-    text = re.sub(r'(?<!\\)\t', '\\\\t', text)
+    text = UNESCAPED_NEWLINE_RE.sub('\\\\n', text)
+    text = UNESCAPED_CR_RE.sub('\\\\r', text)
+    text = UNESCAPED_TAB_RE.sub('\\\\t', text)
 
     return text
 
 
-def repair_json(text: str, max_attempts: int = 5) -> Optional[Dict[str, Any]]:
+def repair_json(
+    text: str,
+    max_attempts: int = 5,
+    parse_error: Optional[orjson.JSONDecodeError] = None
+) -> Optional[Dict[str, Any]]:
     """
     Attempt to repair and parse malformed JSON with multiple strategies
 
     Args:
         text: Raw JSON string (potentially malformed)
         max_attempts: Maximum number of repair attempts
+        parse_error: Error from an orjson.loads(text) the caller already
+            tried, so the direct orjson parse is not repeated
 
     Returns:
         Parsed JSON dict or None if all attempts fail
@@ -193,56 +260,94 @@ def repair_json(text: str, max_attempts: int = 5) -> Optional[Dict[str, Any]]:
 
     # Strategy 1: Try direct parse
     try:
-        return json.loads(text)
+        if parse_error is None:
+            return _loads(text)
+        if _stdlib_may_accept(text, parse_error):
+            return json.loads(text)
+        logger.debug(f"Direct parse failed: {parse_error}")
     except json.JSONDecodeError as e:
         logger.debug(f"Direct parse failed: {e}")
 
-    # Strategy 2: Clean and try again
+    # Strategy 2: One tolerant parse with json-repair (handles fences,
+    # surrounding text, missing commas and unbalanced brackets); the hand-rolled
+    # strategies below are only used when the package is not installed
+    if json_repair_lib is None:
+        return _repair_with_strategies(text)
+
     try:
-        cleaned = clean_json_string(text)
-        return json.loads(cleaned)
-    except json.JSONDecodeError as e:
-        logger.debug(f"Cleaned parse failed: {e}")
+        repaired = json_repair_lib.loads(text)
+    except Exception as e:
+        logger.error(f"json-repair failed: {e}. First 500 chars: {text[:500]}")
+        return None
+
+    if isinstance(repaired, dict) and repaired:
+        return repaired
+
+    logger.error(
+        f"json-repair found no JSON object ({type(repaired).__name__}). "
+        f"First 500 chars: {text[:500]}"
+    )
+    return None
+
+
+def _repair_with_strategies(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Fallback repair cascade used when json-repair is not installed
 
-    # Strategy 3: Extract JSON object and parse
+    Args:
+        text: Raw JSON string that failed a direct parse
+
+    Returns:
+        Parsed JSON dict or None if all attempts fail
+    """
+    # Intermediate results are reused by the combined strategy below
+    cleaned = clean_json_string(text)
+
+    # Strategy 3: Clean and try again (unless cleaning changed nothing)
+    if cleaned != text:
+        try:
+            return _loads(cleaned)
+        except json.JSONDecodeError as e:
+            logger.debug(f"Cleaned parse failed: {e}")
+
+    # Strategy 4: Extract JSON object and parse
+    extracted = extract_json_object(text)
     try:
-        extracted = extract_json_object(text)
         if extracted:
-            return json.loads(extracted)
+            return _loads(extracted)
     except json.JSONDecodeError as e:
         logger.debug(f"Extracted parse failed: {e}")
 
-    # Strategy 4: Fix unterminated strings
+    # Strategy 5: Fix unterminated strings
     try:
         fixed = fix_unterminated_strings(text)
-        return json.loads(fixed)
+        return _loads(fixed)
     except json.JSONDecodeError as e:
         logger.debug(f"Unterminated string fix failed: {e}")
 
-    # Strategy 5: Escape control characters
+    # Strategy 6: Escape control characters
     try:
         escaped = escape_control_characters(text)
-        return json.loads(escaped)
+        return _loads(escaped)
     except json.JSONDecodeError as e:
         logger.debug(f"Control character escape failed: {e}")
 
-    # Strategy 6: Combined approach
+    # Strategy 7: Combined approach
     try:
-        text_cleaned = clean_json_string(text)
-        text_extracted = extract_json_object(text_cleaned)
+        text_extracted = extracted if cleaned == text else extract_json_object(cleaned)
         if text_extracted:
             text_fixed = fix_unterminated_strings(text_extracted)
             text_escaped = escape_control_characters(text_fixed)
-            return json.loads(text_escaped)
+            return _loads(text_escaped)
     except json.JSONDecodeError as e:
         logger.debug(f"Combined repair failed: {e}")
 
-    # Strategy 7: Use json5 if available (more lenient parser)
-    try:
-        import json5
-        return json5.loads(text)
-    except (ImportError, Exception) as e:
-        logger.debug(f"json5 parse failed: {e}")
+    # Strategy 8: Use json5 if available (more lenient parser)
+    if json5 is not None:
+        try:
+            return json5.loads(text)
+        except Exception as e:
+            logger.debug(f"json5 parse failed: {e}")
 
     # If all strategies fail, log and return None
     logger.error(f"All JSON repair strategies failed. First 500 chars: {text[:500]}")
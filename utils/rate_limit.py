@@ -0,0 +1,58 @@
+"""
+Token-bucket rate limiting for provider API calls
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTokenBucket:
+    """
+    Token bucket that refills continuously, for requests/min or tokens/min limits
+
+    Callers wait in arrival order, so a burst of concurrent calls is spread
+    over time instead of hitting the provider at once and backing off on 429s.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        """
+        Initialize a full bucket
+
+        Args:
+            capacity: Units allowed per period (also the maximum burst)
+            period: Refill period in seconds
+        """
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """
+        Wait until `amount` units are available, then take them
+
+        Args:
+            amount: Units to take; larger than the capacity waits for a full bucket
+        """
+        amount = min(float(amount), self.capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # The lock is held while waiting, so callers are served in order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+
+                delay = (amount - self._tokens) / self.rate
+                logger.debug(f"Rate limit reached, waiting {delay:.2f}s")
+                await asyncio.sleep(delay)
@@ -0,0 +1,84 @@
+"""
+In-memory LRU cache for OCR results
+"""
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar('V')
+
+
+def document_cache_key(data: bytes, *parts: str) -> str:
+    """
+    Build a cache key from document contents and processing options
+
+    Every field is length-prefixed before hashing, so values that contain
+    separators (e.g. the model name "llava:13b") cannot collide.
+
+    Args:
+        data: Raw document bytes or a digest of them
+        *parts: Extra values that change the result (prompt version, model, quality, ...)
+
+    Returns:
+        Cache key string
+    """
+    digest = hashlib.sha256()
+    for field in (*(part.encode("utf-8") for part in parts), data):
+        digest.update(len(field).to_bytes(8, "big"))
+        digest.update(field)
+    return digest.hexdigest()
+
+
+class ResultCache(Generic[V]):
+    """Bounded least-recently-used cache of processed documents"""
+
+    def __init__(self, max_entries: int = 512):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries: Maximum number of cached results (0 disables caching)
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, V]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """
+        Look up a cached result and mark it as recently used
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached value, or None on a miss
+        """
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        """
+        Store a result, evicting the least recently used entry when full
+
+        Args:
+            key: Cache key
+            value: Result to cache
+        """
+        if self.max_entries <= 0:
+            return
+
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all cached results"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,22 +1,104 @@
 """
 Retry utilities with exponential backoff for LLM calls
 """
+import asyncio
+import random
+import re
 import time
 import logging
-from typing import Callable, Any, Optional, TypeVar, Dict
+from typing import Awaitable, Callable, Any, Optional, Tuple, TypeVar, Dict
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 
 T = TypeVar('T')
 
+# Error messages worth another attempt (parse failures and transient errors)
+RETRY_ERROR_RE = re.compile(
+    r'unterminated string|json|decode|parse|invalid|timeout|connection|rate limit',
+    re.IGNORECASE
+)
+
+
+def _backoff_delays(
+    max_retries: int,
+    initial_delay: float,
+    max_delay: float,
+    exponential_base: float
+) -> Tuple[float, ...]:
+    """
+    Precompute the sleep before each retry
+
+    Args:
+        max_retries: Maximum number of retry attempts
+        initial_delay: Initial delay in seconds
+        max_delay: Maximum delay in seconds
+        exponential_base: Base for exponential backoff
+
+    Returns:
+        Tuple with one delay per retry attempt
+    """
+    delays = []
+    delay = initial_delay
+    for _ in range(max_retries):
+        delays.append(delay)
+        delay = min(delay * exponential_base, max_delay)
+    return tuple(delays)
+
+
+def _retry_after(exception: Exception) -> Optional[float]:
+    """
+    Read a server-requested wait from an exception, if it carries one
+
+    Looks for a `retry_after` attribute first, then a numeric Retry-After
+    header on an attached response (httpx and OpenAI SDK errors).
+
+    Args:
+        exception: Exception that was raised
+
+    Returns:
+        Seconds to wait, or None if the exception does not say
+    """
+    value = getattr(exception, "retry_after", None)
+    if value is None:
+        response = getattr(exception, "response", None)
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            value = headers.get("retry-after")
+
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except (TypeError, ValueError):
+        # HTTP-date form is not worth parsing here; fall back to backoff
+        return None
+
+
+def _retry_delay(base_delay: float, exception: Exception, max_delay: float) -> float:
+    """
+    Pick the sleep before the next retry
+
+    Args:
+        base_delay: Backoff delay for this attempt
+        exception: Exception that triggered the retry
+        max_delay: Maximum delay in seconds
+
+    Returns:
+        Retry-After when given, otherwise the backoff delay with jitter so
+        concurrent callers do not retry in lockstep (both capped at max_delay)
+    """
+    retry_after = _retry_after(exception)
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    return min(base_delay * (0.5 + random.random()), max_delay)
+
 
 def exponential_backoff_retry(
     max_retries: int = 3,
     initial_delay: float = 1.0,
     max_delay: float = 10.0,
     exponential_base: float = 2.0,
-    exceptions: tuple = (Exception,)
+    exceptions: tuple = (Exception,),
+    timeout: Optional[float] = None
 ):
     """
     Decorator for retrying function with exponential backoff
@@ -27,15 +109,18 @@ def exponential_backoff_retry(
         max_delay: Maximum delay in seconds
         exponential_base: Base for exponential backoff
         exceptions: Tuple of exceptions to catch and retry
+        timeout: Give up early if total backoff would exceed this many seconds
 
     Returns:
         Decorated function with retry logic
     """
+    config = RetryConfig(max_retries, initial_delay, max_delay, exponential_base, timeout)
+
     def decorator(func: Callable[..., T]) -> Callable[..., T]:
         @wraps(func)
         def wrapper(*args, **kwargs) -> T:
-            delay = initial_delay
             last_exception = None
+            waited = 0.0
 
             for attempt in range(max_retries + 1):
                 try:
@@ -47,11 +132,67 @@ def exponential_backoff_retry(
                 except exceptions as e:
                     last_exception = e
 
-                    if attempt < max_retries:
-                        time.sleep(delay)
-                        delay = min(delay * exponential_base, max_delay)
-                    else:
+                    delay = config.next_delay(attempt, e, waited)
+                    if delay is None:
                         raise last_exception
+                    time.sleep(delay)
+                    waited += delay
+
+            # If we get here, all retries failed
+            raise last_exception
+
+        return wrapper
+    return decorator
+
+
+def async_exponential_backoff_retry(
+    max_retries: int = 3,
+    initial_delay: float = 1.0,
+    max_delay: float = 10.0,
+    exponential_base: float = 2.0,
+    exceptions: tuple = (Exception,),
+    timeout: Optional[float] = None
+):
+    """
+    Decorator for retrying a coroutine function with exponential backoff
+
+    Same behavior as exponential_backoff_retry, but backoff delays use
+    asyncio.sleep, so other requests keep running while one waits.
+
+    Args:
+        max_retries: Maximum number of retry attempts
+        initial_delay: Initial delay in seconds
+        max_delay: Maximum delay in seconds
+        exponential_base: Base for exponential backoff
+        exceptions: Tuple of exceptions to catch and retry
+        timeout: Give up early if total backoff would exceed this many seconds
+
+    Returns:
+        Decorated coroutine function with retry logic
+    """
+    config = RetryConfig(max_retries, initial_delay, max_delay, exponential_base, timeout)
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @wraps(func)
+        async def wrapper(*args, **kwargs) -> T:
+            last_exception = None
+            waited = 0.0
+
+            for attempt in range(max_retries + 1):
+                try:
+                    result = await func(*args, **kwargs)
+                    if attempt > 0:
+                        logger.info(f"Success on attempt {attempt + 1} for {func.__name__}")
+                    return result
+
+                except exceptions as e:
+                    last_exception = e
+
+                    delay = config.next_delay(attempt, e, waited)
+                    if delay is None:
+                        raise last_exception
+                    await asyncio.sleep(delay)
+                    waited += delay
 
             # If we get here, all retries failed
             raise last_exception
@@ -68,12 +209,51 @@ class RetryConfig:
         max_retries: int = 3,
         initial_delay: float = 1.0,
         max_delay: float = 10.0,
-        exponential_base: float = 2.0
+        exponential_base: float = 2.0,
+        timeout: Optional[float] = None,
+        retry_on: Optional[Callable[[Exception], bool]] = None
     ):
         self.max_retries = max_retries
         self.initial_delay = initial_delay
         self.max_delay = max_delay
         self.exponential_base = exponential_base
+        self.timeout = timeout
+        # Predicate for exceptions worth another attempt; None retries all
+        self.retry_on = retry_on
+        self._delays: Optional[Tuple[Tuple[float, ...], Tuple[float, ...]]] = None
+
+    @property
+    def delays(self) -> Tuple[float, ...]:
+        """Sleep before each retry, recomputed only if the settings change"""
+        params = (self.max_retries, self.initial_delay, self.max_delay, self.exponential_base)
+        if self._delays is None or self._delays[0] != params:
+            self._delays = (params, _backoff_delays(*params))
+        return self._delays[1]
+
+    def is_retryable(self, exception: Exception) -> bool:
+        """Check whether an exception is worth another attempt"""
+        return self.retry_on is None or self.retry_on(exception)
+
+    def next_delay(self, attempt: int, exception: Exception, waited: float) -> Optional[float]:
+        """
+        Sleep before retrying after a failed attempt
+
+        Args:
+            attempt: Zero-based index of the attempt that failed
+            exception: Exception it raised
+            waited: Seconds already spent sleeping between attempts
+
+        Returns:
+            Seconds to sleep, or None if no retry is left (attempts or timeout)
+        """
+        if attempt >= self.max_retries:
+            return None
+
+        delay = _retry_delay(self.delays[attempt], exception, self.max_delay)
+        if self.timeout is not None and waited + delay > self.timeout:
+            logger.error(f"Retry budget of {self.timeout}s exhausted after {attempt + 1} attempts")
+            return None
+        return delay
 
 
 def retry_with_config(
@@ -95,10 +275,10 @@ def retry_with_config(
         Function result
 
     Raises:
-        Last exception if all retries fail
+        Last exception if all retries fail, or at once if it is not retryable
     """
-    delay = config.initial_delay
     last_exception = None
+    waited = 0.0
 
     for attempt in range(config.max_retries + 1):
         try:
@@ -108,13 +288,66 @@ def retry_with_config(
             return result
 
         except Exception as e:
+            if not config.is_retryable(e):
+                logger.error(f"Not retrying {type(e).__name__}: {str(e)}")
+                raise
+            last_exception = e
+
+            delay = config.next_delay(attempt, e, waited)
+            if delay is None:
+                logger.error(f"All {attempt + 1} attempts failed: {str(e)}")
+                break
+            time.sleep(delay)
+            waited += delay
+
+    raise last_exception
+
+
+async def retry_with_config_async(
+    config: RetryConfig,
+    func: Callable[..., Awaitable[T]],
+    *args,
+    **kwargs
+) -> T:
+    """
+    Retry a coroutine function with given configuration
+
+    Backoff delays use asyncio.sleep, so other requests keep running.
+
+    Args:
+        config: Retry configuration
+        func: Coroutine function to call
+        *args: Positional arguments for function
+        **kwargs: Keyword arguments for function
+
+    Returns:
+        Function result
+
+    Raises:
+        Last exception if all retries fail, or at once if it is not retryable
+    """
+    last_exception = None
+    waited = 0.0
+
+    for attempt in range(config.max_retries + 1):
+        try:
+            result = await func(*args, **kwargs)
+            if attempt > 0:
+                logger.info(f"Success on attempt {attempt + 1} for {func.__name__}")
+            return result
+
+        except Exception as e:
+            if not config.is_retryable(e):
+                logger.error(f"Not retrying {type(e).__name__}: {str(e)}")
+                raise
             last_exception = e
 
-            if attempt < config.max_retries:
-                time.sleep(delay)
-                delay = min(delay * config.exponential_base, config.max_delay)
-            else:
-                logger.error(f"All {config.max_retries + 1} attempts failed: {str(e)}")
+            delay = config.next_delay(attempt, e, waited)
+            if delay is None:
+                logger.error(f"All {attempt + 1} attempts failed: {str(e)}")
+                break
+            await asyncio.sleep(delay)
+            waited += delay
 
     raise last_exception
 
@@ -129,21 +362,5 @@ def should_retry_for_json_error(exception: Exception) -> bool:
     Returns:
         True if we should retry, False otherwise
     """
-    # Retry on JSON decode errors
-    if isinstance(exception, ValueError) and "JSON" in str(exception):
-        return True
-
-    # Retry on specific error messages
-    error_msg = str(exception).lower()
-    retry_keywords = [
-        "unterminated string",
-        "json",
-        "decode",
-        "parse",
-        "invalid",
-        "timeout",
-        "connection",
-        "rate limit"
-    ]
-
-    return any(keyword in error_msg for keyword in retry_keywords)
+    # Covers JSON decode errors ("json") as well as the transient errors
+    return RETRY_ERROR_RE.search(str(exception)) is not None